@@ -0,0 +1,60 @@
+"""
+Бенчмарк поиска ближайшего города: полный перебор с haversine по каждой точке
+против CityIndex (KD-дерево scipy и перебор блоками numpy).
+Запуск: python bench_city_index.py
+"""
+import time
+
+import numpy as np
+
+import city_index
+from city_index import CityIndex, EARTH_RADIUS_KM
+
+POINT_COUNTS = [10_000, 100_000, 1_000_000]
+# Полный перебор по точке медленный, на больших объемах его не гоняем
+SCAN_MAX_POINTS = 10_000
+
+def random_points(count):
+    # Примерный охват России
+    rnd = np.random.default_rng(42)
+    return rnd.uniform(42, 70, count), rnd.uniform(20, 180, count)
+
+def full_scan(index, latitude, longitude):
+    """Прежний способ: haversine от точки до каждого города; возвращает расстояния в км"""
+    lat1, lon1 = np.radians(index.latitude), np.radians(index.longitude)
+    result = np.empty(len(latitude))
+    for i, (lat, lon) in enumerate(zip(np.radians(latitude), np.radians(longitude))):
+        a = np.sin((lat1 - lat) / 2) ** 2 + np.cos(lat) * np.cos(lat1) * np.sin((lon1 - lon) / 2) ** 2
+        result[i] = np.min(2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a)))
+    return result
+
+def main():
+    tree_index = city_index.load_city_index()
+    brute_index = CityIndex.from_csv()
+    brute_index.tree = None
+    print(f"Городов в индексе: {len(tree_index)}")
+    print(f"{'точек':>10} {'способ':<14} {'время, с':>10} {'точек/с':>12}")
+
+    for count in POINT_COUNTS:
+        latitude, longitude = random_points(count)
+        results = {}
+        for name, index in (("KD-дерево", tree_index), ("перебор numpy", brute_index)):
+            started = time.perf_counter()
+            results[name] = index.nearest(latitude, longitude)[1]
+            elapsed = time.perf_counter() - started
+            print(f"{count:>10} {name:<14} {elapsed:>10.3f} {count / elapsed:>12,.0f}")
+        if count <= SCAN_MAX_POINTS:
+            started = time.perf_counter()
+            results["полный скан"] = full_scan(tree_index, latitude, longitude)
+            elapsed = time.perf_counter() - started
+            print(f"{count:>10} {'полный скан':<14} {elapsed:>10.3f} {count / elapsed:>12,.0f}")
+
+        # Сравниваются расстояния: в CSV есть города с одинаковыми координатами
+        reference = results["KD-дерево"]
+        for name, found in results.items():
+            mismatches = np.count_nonzero(np.abs(found - reference) > 1e-6)
+            if mismatches:
+                print(f"  {name}: расхождений с KD-деревом {mismatches}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Микробенчмарк разбора полей карточек ДТП: старые хелперы на strptime
+против dtp_parsers. Запуск: python bench_dtp_parsers.py
+"""
+import random
+import timeit
+from datetime import datetime
+
+import dtp_parsers
+
+N = 100_000
+REPEAT = 5
+
+# Старые реализации из dtp_processing.py для сравнения
+def legacy_parse_date(date_str):
+    try:
+        return datetime.strptime(date_str, '%d.%m.%Y').date() if date_str else None
+    except:
+        return None
+
+def legacy_parse_time(time_str):
+    try:
+        return datetime.strptime(time_str, '%H:%M').time() if time_str else None
+    except:
+        return None
+
+def legacy_parse_int(value):
+    try:
+        return int(value) if value is not None else 0
+    except:
+        return 0
+
+def legacy_parse_float(value):
+    try:
+        return float(str(value).replace(',', '.')) if value is not None else 0.0
+    except:
+        return 0.0
+
+def make_sample():
+    rnd = random.Random(42)
+    # Одна выгрузка = один район за месяц: дат не больше 31
+    dates = [f"{rnd.randint(1, 28):02d}.03.2024" for _ in range(N)]
+    times = [f"{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}" for _ in range(N)]
+    ints = [rnd.choice(["0", "1", "2", 0, 1, "", None]) for _ in range(N)]
+    floats = [rnd.choice([f"{rnd.uniform(54, 57):.6f}".replace('.', ','), rnd.uniform(54, 57), "", None])
+              for _ in range(N)]
+    return dates, times, ints, floats
+
+def bench(label, func, values):
+    best = min(timeit.repeat(lambda: [func(v) for v in values], number=1, repeat=REPEAT))
+    print(f"{label:<28} {best * 1000:8.1f} мс  {best / len(values) * 1e9:7.0f} нс/значение")
+    return best
+
+def main():
+    dates, times, ints, floats = make_sample()
+
+    cases = [
+        ("date", dates, legacy_parse_date, dtp_parsers.parse_date),
+        ("time", times, legacy_parse_time, dtp_parsers.parse_time),
+        ("int", ints, legacy_parse_int, dtp_parsers.parse_int),
+        ("float", floats, legacy_parse_float, dtp_parsers.parse_float),
+    ]
+    for name, values, legacy, fast in cases:
+        assert [legacy(v) for v in values] == [fast(v) for v in values], name
+        old = bench(f"{name}: strptime/str()", legacy, values)
+        new = bench(f"{name}: dtp_parsers", fast, values)
+        print(f"{'':<28} ускорение x{old / new:.1f}")
+
+    for name, values, batch in (("date", dates, dtp_parsers.parse_dates),
+                                 ("time", times, dtp_parsers.parse_times)):
+        best = min(timeit.repeat(lambda: batch(values), number=1, repeat=REPEAT))
+        print(f"{name + ': пакетный разбор':<28} {best * 1000:8.1f} мс")
+
+if __name__ == "__main__":
+    main()
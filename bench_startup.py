@@ -0,0 +1,73 @@
+"""
+Время запуска точек входа ETL: каждый модуль импортируется в отдельном процессе
+с -X importtime, из отчета берется накопленное время импорта самого модуля
+и самые тяжелые зависимости верхнего уровня. База и сеть не нужны: после
+переноса работы в main() импорт модуля ничего не запускает.
+Запуск: python bench_startup.py [модуль ...] [--repeat N]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINTS = [
+    "actions_etl_weather_current_from_open_meteo",
+    "create_table",
+    "download_city_from_wiki",
+    "download_weather_archive",
+    "dtp_download",
+    "dtp_processing",
+    "etl_city_from_csv",
+    "etl_weather_archive_csv",
+    "weather_cache",
+    "weather_gaps",
+]
+
+# Строка отчета: "import time:  self [us] | cumulative | imported package"
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+TOP_IMPORTS = 3
+
+def measure(module):
+    """(мкс на импорт модуля, [(мкс, зависимость), ...]) или None при ошибке импорта"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        return None
+
+    # Отчет идет снизу вверх: зависимости (отступ 3) печатаются раньше своего модуля (отступ 1)
+    children = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if indent == 3:
+            children.append((cumulative, name))
+        elif indent == 1:
+            if name == module:
+                return cumulative, sorted(children, reverse=True)[:TOP_IMPORTS]
+            children = []
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Время импорта точек входа ETL.")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS, help="Модули для замера")
+    parser.add_argument("--repeat", type=int, default=5, help="Число замеров на модуль (берется медиана)")
+    args = parser.parse_args()
+
+    print(f"{'модуль':<48} {'импорт, мс':>10}  тяжелые зависимости")
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        if any(run is None for run in runs):
+            print(f"{module:<48} {'ошибка':>10}  (не установлены зависимости?)")
+            continue
+        median = statistics.median(total for total, _ in runs)
+        heavy = ", ".join(f"{name} {us / 1000:.0f}" for us, name in runs[-1][1])
+        print(f"{module:<48} {median / 1000:>10.1f}  {heavy}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Бенчмарк пакетной проверки данных (data_validation.py): сколько добавляет проверка
+к пакету карточек ДТП и блоку погоды. База не нужна. Запуск: python bench_validation.py
+"""
+import time
+from datetime import date
+
+import numpy as np
+
+from data_validation import as_float_array, validate_dtp_rows, validate_weather_columns
+from region_polygons import load_region_polygons
+from weather_db import HOURLY_VARIABLES
+
+BATCH_SIZES = [100, 1000, 10_000]
+REPEATS = 5
+# Доля испорченных строк в синтетическом пакете
+BAD_SHARE = 0.02
+
+def dtp_rows(count):
+    """Карточки вокруг Лобни (Московская область) с долей нулевых координат и пустых дат"""
+    rnd = np.random.default_rng(42)
+    bad = rnd.random(count) < BAD_SHARE
+    latitude = np.where(bad, 0.0, rnd.normal(56.01, 0.05, count))
+    longitude = np.where(bad, 0.0, rnd.normal(37.47, 0.05, count))
+    return [{
+        "region_id": "46",
+        "dtp_date": None if i % 97 == 0 else date(2020, 1, 1 + i % 28),
+        "deaths": 0, "wounded": int(rnd.integers(0, 3)), "vehicles_count": 2, "participants_count": 3,
+        "coord_w": float(latitude[i]), "coord_l": float(longitude[i]),
+    } for i in range(count)]
+
+def weather_columns(count):
+    rnd = np.random.default_rng(42)
+    columns = {name: rnd.uniform(0, 1, count).astype(np.float32) for name in HOURLY_VARIABLES}
+    columns["temperature_2m"][rnd.random(count) < BAD_SHARE] = 999
+    return columns
+
+def best_time(func, *args):
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    started = time.perf_counter()
+    load_region_polygons()
+    print(f"Загрузка границ регионов (один раз на процесс): {time.perf_counter() - started:.3f} с")
+    print(f"{'строк':>8} {'ДТП, мс':>10} {'погода, мс':>11} {'погода из строк, мс':>20}")
+    for count in BATCH_SIZES:
+        rows = dtp_rows(count)
+        # validate_dtp_rows меняет строки, поэтому каждый прогон получает копию
+        dtp = best_time(lambda: validate_dtp_rows([dict(row) for row in rows]))
+        columns = weather_columns(count)
+        weather = best_time(validate_weather_columns, columns)
+        # Путь process_batch: строки CSV -> колонки float
+        values = [[str(x) for x in row] for row in zip(*columns.values())]
+        from_rows = best_time(lambda: validate_weather_columns(
+            {name: as_float_array([row[i] for row in values]) for i, name in enumerate(HOURLY_VARIABLES)}))
+        print(f"{count:>8} {dtp * 1000:>10.1f} {weather * 1000:>11.2f} {from_rows * 1000:>20.1f}")
+
+if __name__ == "__main__":
+    main()
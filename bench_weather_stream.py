@@ -0,0 +1,126 @@
+"""
+Бенчмарк подготовки данных текущей погоды к загрузке: прежний путь
+(списки строк + mogrify в одну большую SQL-строку на пакет) против потокового
+(блоки колонок -> текст COPY). База не нужна: COPY-поток вычитывается в пустоту
+так же, как его читает psycopg2. Запуск: python bench_weather_stream.py
+"""
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from psycopg2.extensions import adapt
+
+from weather_db import HOURLY_VARIABLES, ChunkStream, copy_chunks
+
+ROW_COUNTS = [10_000, 100_000, 1_000_000]
+# Прежний путь построчный и медленный, на больших объемах его не гоняем
+LEGACY_MAX_ROWS = 100_000
+BATCH_SIZE = 8000
+COPY_READ_SIZE = 8192
+CITY = {"latitude": 56.0104473, "longitude": 37.4670831}
+
+class FakeVariable:
+    def __init__(self, values):
+        self.values = values
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+class FakeHourly:
+    """Ответ Open-Meteo с тем же интерфейсом, что у FlatBuffers-объекта"""
+
+    def __init__(self, rows):
+        rnd = np.random.default_rng(42)
+        self.rows = rows
+        self.variables = []
+        for _ in HOURLY_VARIABLES:
+            values = rnd.normal(5, 10, rows).astype(np.float32)
+            values[rnd.random(rows) < 0.01] = np.nan
+            self.variables.append(values)
+
+    def Time(self):
+        return 1_700_000_000
+
+    def TimeEnd(self):
+        return self.Time() + self.rows * self.Interval()
+
+    def Interval(self):
+        return 10800
+
+    def Variables(self, i):
+        return FakeVariable(self.variables[i])
+
+class FakeResponse:
+    def __init__(self, rows):
+        self.hourly = FakeHourly(rows)
+
+    def Hourly(self):
+        return self.hourly
+
+def convert_numpy_types(value):
+    if isinstance(value, (np.float32, np.float64)):
+        return float(value)
+    elif isinstance(value, (np.int32, np.int64)):
+        return int(value)
+    elif isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+def legacy(response):
+    """Прежний код actions_etl_weather_current_from_open_meteo.py; mogrify заменен на adapt"""
+    hourly = response.Hourly()
+    dates = pd.date_range(
+        start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
+        end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
+        freq=pd.Timedelta(seconds=hourly.Interval()),
+        inclusive="left"
+    )
+    sent = 0
+    batch = []
+    for i in range(len(dates)):
+        row = [dates[i]]
+        row += [convert_numpy_types(hourly.Variables(k).ValuesAsNumpy()[i]) for k in range(len(HOURLY_VARIABLES))]
+        row += [CITY["latitude"], CITY["longitude"]]
+        batch.append([None if x is not None and pd.isna(x) else x for x in row])
+        if len(batch) >= BATCH_SIZE or i == len(dates) - 1:
+            args_str = ','.join(
+                '(' + ','.join(adapt(x).getquoted().decode('utf-8') for x in values) + ')' for values in batch
+            )
+            sent += len(f"INSERT INTO lbn.weather_BUFFER VALUES {args_str}")
+            batch = []
+    return sent
+
+def streaming(response):
+    stream = ChunkStream(copy_chunks(response, CITY))
+    sent = 0
+    while True:
+        data = stream.read(COPY_READ_SIZE)
+        if not data:
+            return sent
+        sent += len(data)
+
+def measure(func, response):
+    # Время и пик памяти меряются разными прогонами: tracemalloc сильно замедляет код
+    started = time.perf_counter()
+    sent = func(response)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    func(response)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, sent
+
+def main():
+    print(f"{'строк':>10} {'путь':<10} {'время, с':>10} {'пик памяти, МБ':>16} {'отправлено, МБ':>16}")
+    for rows in ROW_COUNTS:
+        response = FakeResponse(rows)
+        for name, func in (("прежний", legacy), ("потоковый", streaming)):
+            if func is legacy and rows > LEGACY_MAX_ROWS:
+                continue
+            elapsed, peak, sent = measure(func, response)
+            print(f"{rows:>10} {name:<10} {elapsed:>10.2f} {peak / 1024 / 1024:>16.1f} {sent / 1024 / 1024:>16.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import csv
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+CITIES_CSV = 'russian_cities.csv'
+EARTH_RADIUS_KM = 6371.0
+
+# Размер блока точек при поиске перебором без scipy (блок x города float64)
+BRUTE_FORCE_CHUNK = 20000
+
+def to_unit_vectors(latitude, longitude):
+    """Широта/долгота в градусах -> точки на единичной сфере (N, 3)"""
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+def chord_to_km(chord):
+    """Длина хорды единичной сферы -> расстояние по дуге большого круга (haversine) в км"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+class CityIndex:
+    """
+    Пространственный индекс точек (городов) для поиска ближайшей.
+    Точки хранятся единичными векторами: порядок по длине хорды совпадает
+    с порядком по расстоянию haversine, поэтому KD-дерево в 3D дает точный
+    ближайший город без поправок на сходимость меридианов. Без scipy
+    используется перебор блоками через матричное умножение.
+    """
+
+    def __init__(self, names, regions, latitude, longitude):
+        self.names = np.asarray(names, dtype=object)
+        self.regions = np.asarray(regions, dtype=object)
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        self.vectors = to_unit_vectors(self.latitude, self.longitude)
+        self.tree = cKDTree(self.vectors) if cKDTree is not None else None
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_csv(cls, path=CITIES_CSV):
+        names, regions, latitude, longitude = [], [], [], []
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row['latitude'] and row['longitude']:
+                    names.append(row['city_name'])
+                    regions.append(row['region'])
+                    latitude.append(float(row['latitude']))
+                    longitude.append(float(row['longitude']))
+        return cls(names, regions, latitude, longitude)
+
+    @classmethod
+    def from_db(cls, conn):
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT city_name, region, latitude, longitude
+                FROM lbn.city
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            """)
+            rows = cur.fetchall()
+        return cls(*zip(*rows)) if rows else cls([], [], [], [])
+
+    def nearest(self, latitude, longitude, k=1):
+        """
+        Ближайшие k точек индекса для массива координат.
+        Возвращает (индексы, расстояния в км) формы (N,) при k=1 и (N, k) иначе;
+        NaN-координаты дают индекс -1 и расстояние NaN.
+        """
+        points = np.atleast_2d(to_unit_vectors(latitude, longitude))
+        valid = ~np.isnan(points).any(axis=1)
+        shape = (len(points),) if k == 1 else (len(points), k)
+        indices = np.full(shape, -1, dtype=np.int64)
+        distances = np.full(shape, np.nan)
+
+        if valid.any():
+            if self.tree is not None:
+                chord, idx = self.tree.query(points[valid], k=k)
+            else:
+                chord, idx = self._brute_force(points[valid], k)
+            indices[valid] = idx
+            distances[valid] = chord_to_km(chord)
+        return indices, distances
+
+    def _brute_force(self, points, k):
+        chords, indices = [], []
+        for start in range(0, len(points), BRUTE_FORCE_CHUNK):
+            # Для единичных векторов |a - b|^2 = 2 - 2 a.b: ближайший - с наибольшим скалярным произведением
+            dots = points[start:start + BRUTE_FORCE_CHUNK] @ self.vectors.T
+            if k == 1:
+                idx = dots.argmax(axis=1)
+                best = dots[np.arange(len(dots)), idx]
+            else:
+                idx = np.argpartition(-dots, k - 1, axis=1)[:, :k]
+                best = np.take_along_axis(dots, idx, axis=1)
+                order = np.argsort(-best, axis=1)
+                idx = np.take_along_axis(idx, order, axis=1)
+                best = np.take_along_axis(best, order, axis=1)
+            chords.append(np.sqrt(np.clip(2 - 2 * best, 0, None)))
+            indices.append(idx)
+        return np.concatenate(chords), np.concatenate(indices)
+
+    def nearest_within(self, latitude, longitude, max_km):
+        """Индекс ближайшей точки или -1, если она дальше max_km"""
+        indices, distances = self.nearest(latitude, longitude)
+        indices[~(distances <= max_km)] = -1
+        return indices
+
+    def lookup(self, indices, field='names'):
+        """Значения поля (names, regions, latitude, longitude) по индексам; -1 -> None"""
+        indices = np.asarray(indices)
+        values = getattr(self, field)[np.maximum(indices, 0)].astype(object)
+        values[indices < 0] = None
+        return values
+
+@lru_cache(maxsize=None)
+def load_city_index(path=CITIES_CSV):
+    """Индекс городов из CSV, строится при первом обращении и кэшируется"""
+    return CityIndex.from_csv(path)
+
+@lru_cache(maxsize=None)
+def load_weather_index():
+    """Индекс точек, для которых ведется погода (weather_db.CITIES)"""
+    from weather_db import CITIES
+
+    names = [f'{city["latitude"]}, {city["longitude"]}' for city in CITIES]
+    latitude = [city["latitude"] for city in CITIES]
+    longitude = [city["longitude"] for city in CITIES]
+    return CityIndex(names, [None] * len(CITIES), latitude, longitude)
@@ -1,102 +1,291 @@
-import psycopg2
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-try:
-    connection = psycopg2.connect(
-        user=os.getenv("user"),
-        password=os.getenv("password"),
-        host=os.getenv("host"),
-        port=os.getenv("port"),
-        dbname=os.getenv("dbname")
-    )
-    
-    cursor = connection.cursor()
-    
-    #cursor.execute("DROP TABLE IF EXISTS lbn.weather_BUFFER")
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS lbn.weather_BUFFER (
-            date TIMESTAMP,
-            temperature_2m FLOAT,
-            wind_speed_10m FLOAT,
-            wind_direction_10m FLOAT,
-            apparent_temperature FLOAT,
-            precipitation FLOAT,
-            rain FLOAT,
-            showers FLOAT,
-            snowfall FLOAT,
-            snow_depth FLOAT,
-            is_day FLOAT,
-            sunshine_duration FLOAT,
-            latitude FLOAT,
-            longitude FLOAT
-        )
-    """)
-
-    #cursor.execute("DROP TABLE IF EXISTS lbn.weather")
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS lbn.weather (
-            date TIMESTAMP,
-            temperature_2m REAL,
-            wind_speed_10m REAL,
-            wind_direction_10m REAL,
-            apparent_temperature REAL,
-            precipitation REAL,
-            rain REAL,
-            showers REAL,
-            snowfall REAL,
-            snow_depth REAL,
-            is_day BOOLEAN,
-            sunshine_duration INT,
-            latitude FLOAT,
-            longitude FLOAT,
-            DATE_UPDATE TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (latitude, longitude, date)
-        )
-    """)    
-
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_weather_date ON lbn.weather (date)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_weather_long_lat ON lbn.weather (latitude,longitude)")
-
-
-    cursor.execute("""DROP TABLE lbn.city_BUFFER""")
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS lbn.city_BUFFER (
-            city_name VARCHAR(4000),
-            region VARCHAR(4000),
-            federal_district VARCHAR(4000),
-            population VARCHAR(4000),
-            foundation_year VARCHAR(4000),
-            status VARCHAR(4000),
-            old_name VARCHAR(4000),
-            latitude VARCHAR(4000),
-            longitude VARCHAR(4000)
-        );
+from db import connect
+from dtp_dictionary import ENCODED_COLUMNS
+from weather_tiering import DAILY_COLUMNS, daily_select
+
+# Колонки таблиц ДТП в представлениях lbn.v_dtp_* (категориальные колонки раскодируются по lbn.dtp_dict)
+DTP_VIEW_COLUMNS = {
+    "lbn.dtp_main": [
+        "kart_id", "region_id", "district_id", "row_num", "dtp_date", "dtp_time", "district",
+        "dtp_type", "deaths", "wounded", "vehicles_count", "participants_count", "emtp_number",
+        "settlement", "street", "house", "road", "km", "m", "road_category", "road_class",
+        "road_quality", "weather", "road_condition", "lighting", "dtp_severity", "coord_w", "coord_l",
+        "geohash", "weather_class", "date_update"
+    ],
+    "lbn.dtp_vehicles": [
+        "kart_id", "region_id", "district_id", "vehicle_num", "vehicle_status", "vehicle_type",
+        "brand", "model", "color", "drive_type", "year", "damage", "tech_condition",
+        "ownership", "owner_type", "date_update"
+    ],
+    "lbn.dtp_participants": [
+        "kart_id", "region_id", "district_id", "vehicle_num", "participant_type", "violations",
+        "status", "gender", "age", "alcohol", "safety_belt", "participant_num", "seat_group",
+        "injured_card_id", "hidden_status", "date_update"
+    ],
+}
+
+def decoded_select(table, overrides):
+    columns = []
+    for column in DTP_VIEW_COLUMNS[table]:
+        if column in overrides:
+            columns.append(f"{overrides[column]} AS {column}")
+        elif column in ENCODED_COLUMNS[table]:
+            columns.append(f"COALESCE(t.{column}, (SELECT value FROM lbn.dtp_dict WHERE id = t.{column}_id)) AS {column}")
+        else:
+            columns.append(f"t.{column}")
+    return f"SELECT {', '.join(columns)} FROM {table} t"
+
+def main():
+    try:
+        connection = connect()
+
+        cursor = connection.cursor()
+
+        #cursor.execute("DROP TABLE IF EXISTS lbn.weather_BUFFER")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.weather_BUFFER (
+                date TIMESTAMP,
+                temperature_2m FLOAT,
+                wind_speed_10m FLOAT,
+                wind_direction_10m FLOAT,
+                apparent_temperature FLOAT,
+                precipitation FLOAT,
+                rain FLOAT,
+                showers FLOAT,
+                snowfall FLOAT,
+                snow_depth FLOAT,
+                is_day FLOAT,
+                sunshine_duration FLOAT,
+                latitude FLOAT,
+                longitude FLOAT
+            )
+        """)
+
+        #cursor.execute("DROP TABLE IF EXISTS lbn.weather")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.weather (
+                date TIMESTAMP,
+                temperature_2m REAL,
+                wind_speed_10m REAL,
+                wind_direction_10m REAL,
+                apparent_temperature REAL,
+                precipitation REAL,
+                rain REAL,
+                showers REAL,
+                snowfall REAL,
+                snow_depth REAL,
+                is_day BOOLEAN,
+                sunshine_duration INT,
+                latitude FLOAT,
+                longitude FLOAT,
+                DATE_UPDATE TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (latitude, longitude, date)
+            )
+        """)    
+
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_weather_date ON lbn.weather (date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_weather_long_lat ON lbn.weather (latitude,longitude)")
+
+        # Дневные агрегаты старых лет погоды (weather_tiering.py compact)
+        daily_columns = ",\n".join(f"                {name} {column_type}" for name, column_type, _ in DAILY_COLUMNS)
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS lbn.weather_daily (
+                latitude FLOAT,
+                longitude FLOAT,
+                day DATE,
+{daily_columns},
+                date_update TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (latitude, longitude, day)
+            )
+        """)
+
+        # Непрерывный дневной ряд: сжатые годы и агрегаты 3-часовых данных горячих лет
+        names = ", ".join(name for name, _, _ in DAILY_COLUMNS)
+        cursor.execute(f"""
+            CREATE OR REPLACE VIEW lbn.v_weather_daily AS
+            SELECT latitude, longitude, day, {names} FROM lbn.weather_daily
+            UNION ALL
+            {daily_select("TRUE")}
+        """)
+
+
+        # Буфер городов - промежуточная таблица etl_city_from_csv.py, пересоздается при каждом запуске
+        cursor.execute("""DROP TABLE IF EXISTS lbn.city_BUFFER""")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.city_BUFFER (
+                city_name VARCHAR(4000),
+                region VARCHAR(4000),
+                federal_district VARCHAR(4000),
+                population VARCHAR(4000),
+                foundation_year VARCHAR(4000),
+                status VARCHAR(4000),
+                old_name VARCHAR(4000),
+                latitude VARCHAR(4000),
+                longitude VARCHAR(4000)
+            );
+            """)
+
+        # lbn.city не пересоздается: ее пополняют upsert-ом etl_city_from_csv.py и download_city_from_wiki.py,
+        # а повторный запуск скрипта ради новых таблиц не должен стирать справочник городов
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.city (
+                city_name VARCHAR(4000) NOT NULL,
+                region VARCHAR(4000),
+                federal_district VARCHAR(4000),
+                population INT,
+                foundation_year VARCHAR(4000),
+                status VARCHAR(4000),
+                old_name VARCHAR(4000),
+                latitude FLOAT,
+                longitude FLOAT,
+                date_update TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (latitude, longitude)
+            );
+            """)
+
+        # Захват пакетов буфера ДТП параллельными воркерами dtp_processing.py
+        cursor.execute("ALTER TABLE lbn.dtp_buffer ADD COLUMN IF NOT EXISTS date_claim TIMESTAMP")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_dtp_buffer_unprocessed ON lbn.dtp_buffer (id)
+            WHERE date_processing IS NULL AND is_error = FALSE
         """)
 
-    cursor.execute("""DROP TABLE lbn.city""")
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS lbn.city (
-            city_name VARCHAR(4000) NOT NULL,
-            region VARCHAR(4000),
-            federal_district VARCHAR(4000),
-            population INT,
-            foundation_year VARCHAR(4000),
-            status VARCHAR(4000),
-            old_name VARCHAR(4000),
-            latitude FLOAT,
-            longitude FLOAT,
-            date_update TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (latitude, longitude)
-        );
+        # Представления над кодами словаря пересоздаются ниже; сняты заранее, чтобы сменить тип колонок кодов
+        cursor.execute("""
+            DROP VIEW IF EXISTS lbn.v_dtp_factors, lbn.v_dtp_objects,
+                lbn.v_dtp_main, lbn.v_dtp_vehicles, lbn.v_dtp_participants
         """)
 
-    connection.commit()
-    cursor.close()
-    connection.close()
-    print('Скрипт выполнен')
+        # Словарь строк ДТП для хранения факторов, объектов и погоды массивами (dtp_processing.py --child_storage arrays).
+        # Коды INT: последовательность общая для всех видов и тратит значения на конфликтах вставки
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.dtp_dict (
+                id SERIAL PRIMARY KEY,
+                kind VARCHAR(32) NOT NULL,
+                value TEXT NOT NULL,
+                date_update TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (kind, value)
+            )
+        """)
+        # Словарь, созданный раньше с SMALLSERIAL, переводится на INT (для INT-колонок - без изменений)
+        cursor.execute("ALTER TABLE lbn.dtp_dict ALTER COLUMN id TYPE INT")
+        cursor.execute("ALTER SEQUENCE IF EXISTS lbn.dtp_dict_id_seq AS INT")
+        array_columns = ["weather_ids", "ndu_ids", "sdor_ids", "object_ids"]
+        cursor.execute("ALTER TABLE lbn.dtp_main "
+                       + ", ".join(f"ADD COLUMN IF NOT EXISTS {column} INT[]" for column in array_columns))
+        cursor.execute("ALTER TABLE lbn.dtp_main "
+                       + ", ".join(f"ALTER COLUMN {column} TYPE INT[]" for column in array_columns))
+
+        # Коды категориальных строк ДТП (dtp_processing.py --encode_categories)
+        for table, columns in ENCODED_COLUMNS.items():
+            add_columns = ', '.join(f"ADD COLUMN IF NOT EXISTS {column}_id INT" for column in columns)
+            cursor.execute(f"ALTER TABLE {table} {add_columns}")
+            alter_columns = ', '.join(f"ALTER COLUMN {column}_id TYPE INT" for column in columns)
+            cursor.execute(f"ALTER TABLE {table} {alter_columns}")
+        cursor.execute("ALTER TABLE lbn.dtp_participants ADD COLUMN IF NOT EXISTS violation_ids INT[]")
+        cursor.execute("ALTER TABLE lbn.dtp_participants ALTER COLUMN violation_ids TYPE INT[]")
+
+        # Представления отдают факторы и объекты строками независимо от способа хранения
+        cursor.execute("""
+            CREATE OR REPLACE VIEW lbn.v_dtp_factors AS
+            SELECT kart_id, region_id, district_id, factor_type, factor_description, date_update
+            FROM lbn.dtp_factors
+            UNION ALL
+            SELECT m.kart_id, m.region_id, m.district_id, d.kind, d.value, m.date_update
+            FROM lbn.dtp_main m
+            CROSS JOIN LATERAL unnest(m.ndu_ids || m.sdor_ids) AS f(id)
+            JOIN lbn.dtp_dict d ON d.id = f.id
+        """)
+        cursor.execute("""
+            CREATE OR REPLACE VIEW lbn.v_dtp_objects AS
+            SELECT kart_id, region_id, district_id, object_description, date_update
+            FROM lbn.dtp_objects
+            UNION ALL
+            SELECT m.kart_id, m.region_id, m.district_id, d.value, m.date_update
+            FROM lbn.dtp_main m
+            CROSS JOIN LATERAL unnest(m.object_ids) AS o(id)
+            JOIN lbn.dtp_dict d ON d.id = o.id
+        """)
+
+        # Сводка частоты ДТП по погодным интервалам (weather_dtp_analytics.py) для дашбордов
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.dtp_weather_summary (
+                city_name VARCHAR(100),
+                variable VARCHAR(50),
+                bin_order SMALLINT,
+                bin_label VARCHAR(50),
+                hours INT,
+                accidents INT,
+                rate_per_1000h FLOAT,
+                ci_low FLOAT,
+                ci_high FLOAT,
+                relative_rate FLOAT,
+                date_update TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (city_name, variable, bin_order)
+            )
+        """)
+
+        # Сетка очагов ДТП (dtp_grid.py): геохеш и класс погоды карточки, агрегаты по ячейкам.
+        # Ячейка - префикс геохеша; сравнение "C" делает поиск префикса диапазоном по индексу
+        cursor.execute("""
+            ALTER TABLE lbn.dtp_main
+                ADD COLUMN IF NOT EXISTS geohash VARCHAR(12) COLLATE "C",
+                ADD COLUMN IF NOT EXISTS weather_class VARCHAR(20)
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_dtp_main_geohash ON lbn.dtp_main (geohash, dtp_date)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.dtp_grid (
+                precision SMALLINT,
+                cell VARCHAR(12) COLLATE "C",
+                month DATE,
+                weather_class VARCHAR(20),
+                accidents INT,
+                deaths INT,
+                wounded INT,
+                date_update TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (precision, cell, month, weather_class)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_dtp_grid_month ON lbn.dtp_grid (precision, month)")
+
+        # Карантин проверки данных перед загрузкой (data_validation.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lbn.data_quarantine (
+                id BIGSERIAL PRIMARY KEY,
+                source VARCHAR(50) NOT NULL,
+                record_key JSONB NOT NULL,
+                action VARCHAR(10) NOT NULL,
+                reasons TEXT[] NOT NULL,
+                payload JSONB,
+                date_create TIMESTAMP(0) DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_data_quarantine_source ON lbn.data_quarantine (source, date_create)")
+
+        # Представления отдают исходный текст при любом способе хранения
+        cursor.execute("CREATE VIEW lbn.v_dtp_main AS " + decoded_select("lbn.dtp_main", {
+            "weather": """COALESCE(t.weather, (
+                SELECT string_agg(d.value, ', ' ORDER BY u.ord)
+                FROM unnest(t.weather_ids) WITH ORDINALITY AS u(id, ord)
+                JOIN lbn.dtp_dict d ON d.id = u.id
+            ))"""
+        }))
+        cursor.execute("CREATE OR REPLACE VIEW lbn.v_dtp_vehicles AS " + decoded_select("lbn.dtp_vehicles", {}))
+        cursor.execute("CREATE OR REPLACE VIEW lbn.v_dtp_participants AS " + decoded_select("lbn.dtp_participants", {
+            "violations": """COALESCE(t.violations, ARRAY(
+                SELECT d.value
+                FROM unnest(t.violation_ids) WITH ORDINALITY AS u(id, ord)
+                JOIN lbn.dtp_dict d ON d.id = u.id
+                ORDER BY u.ord
+            ))"""
+        }))
+
+        connection.commit()
+        cursor.close()
+        connection.close()
+        print('Скрипт выполнен')
+
+    except Exception as e:
+        print(f"Error: {e}")
 
-except Exception as e:
-    print(f"Error: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import json
+import logging
+from datetime import date, timedelta
+
+import numpy as np
+from psycopg2.extras import Json, execute_values
+
+from region_polygons import OKATO_REGIONS, load_region_polygons
+
+logger = logging.getLogger(__name__)
+
+# Действия по нарушению, от мягкого к строгому:
+#   flagged - строка загружается как есть, нарушение записывается в карантин;
+#   nulled  - ошибочные значения заменяются на NULL, строка загружается;
+#   dropped - строка не загружается и целиком лежит в карантине
+ACTIONS = ["flagged", "nulled", "dropped"]
+
+# Правила диапазонов: (колонка, минимум, максимум, обязательная, действие).
+# None в границе - без ограничения с этой стороны
+WEATHER_RULES = [
+    ("temperature_2m", -75, 65, False, "nulled"),
+    ("wind_speed_10m", 0, 200, False, "nulled"),
+    ("wind_direction_10m", 0, 360, False, "nulled"),
+    ("apparent_temperature", -90, 75, False, "nulled"),
+    ("precipitation", 0, 500, False, "nulled"),
+    ("rain", 0, 500, False, "nulled"),
+    ("showers", 0, 500, False, "nulled"),
+    ("snowfall", 0, 200, False, "nulled"),
+    ("snow_depth", 0, 20, False, "nulled"),
+    ("is_day", 0, 1, False, "nulled"),
+    # Секунды солнца за шаг (до 3 часов при temporal_resolution hourly_3)
+    ("sunshine_duration", 0, 3 * 3600, False, "nulled"),
+]
+
+# ДТП загружаются с 2014 года (см. README, weather_tiering.HOT_FROM_YEAR). Более ранняя дата
+# только отмечается: удаление не отменить, а карточка может быть настоящей
+DTP_FIRST_DATE = date(2014, 1, 1)
+
+DTP_RULES = [
+    # Без даты карточку не связать ни с погодой, ни с сеткой очагов
+    ("dtp_date", None, None, True, "dropped"),
+    ("dtp_date", DTP_FIRST_DATE, None, False, "flagged"),
+    ("deaths", 0, 100, True, "flagged"),
+    ("wounded", 0, 500, True, "flagged"),
+    ("vehicles_count", 0, 200, True, "flagged"),
+    ("participants_count", 0, 500, True, "flagged"),
+]
+
+# Строк карантина в одном запросе execute_values
+QUARANTINE_PAGE_SIZE = 1000
+
+def as_float_array(values):
+    """Список значений (числа, строки, None) -> float64 с NaN вместо пустых"""
+    values = np.asarray(values, dtype=object)
+    empty = (values == None) | (values == '')  # noqa: E711 - поэлементное сравнение numpy
+    result = np.full(len(values), np.nan)
+    result[~empty] = values[~empty].astype(np.float64)
+    return result
+
+def as_date_array(values):
+    """Список date/None -> datetime64[D] с NaT вместо пустых"""
+    return np.array([np.datetime64('NaT') if value is None else value for value in values], dtype='datetime64[D]')
+
+def check_ranges(columns, rules):
+    """
+    Проверка колонок пакета по правилам. columns: имя -> массив (float64 или datetime64).
+    Возвращает нарушения [(маска строк, причина, действие, колонка)].
+    """
+    issues = []
+    for column, low, high, required, action in rules:
+        values = columns[column]
+        missing = np.isnat(values) if values.dtype.kind == 'M' else np.isnan(values)
+        if required and missing.any():
+            issues.append((missing, f"{column}: пусто", action, column))
+        if low is not None:
+            mask = ~missing & (values < (np.datetime64(low) if values.dtype.kind == 'M' else low))
+            if mask.any():
+                issues.append((mask, f"{column}: меньше {low}", action, column))
+        if high is not None:
+            mask = ~missing & (values > (np.datetime64(high) if values.dtype.kind == 'M' else high))
+            if mask.any():
+                issues.append((mask, f"{column}: больше {high}", action, column))
+    return issues
+
+def check_dtp_coordinates(region_ids, latitude, longitude):
+    """
+    Координаты карточек ДТП по границам регионов. 0/0 (parse_float подставляет 0)
+    и точки вне России обнуляются; точка в другом регионе, чем region_id карточки,
+    только отмечается (границы упрощены, а коды регионов ОКАТО сопоставлены вручную).
+    """
+    polygons = load_region_polygons()
+    missing = np.isnan(latitude) | np.isnan(longitude) | ((latitude == 0) & (longitude == 0))
+    issues = []
+    if missing.any():
+        issues.append((missing, "coord: нет координат", "nulled", ("coord_w", "coord_l")))
+
+    expected = np.zeros(len(latitude), dtype=bool)
+    known = np.zeros(len(latitude), dtype=bool)
+    for region_id in set(region_ids.tolist()):
+        names = OKATO_REGIONS.get(str(region_id))
+        if names:
+            rows = np.flatnonzero((region_ids == region_id) & ~missing)
+            known[rows] = True
+            expected[rows] = polygons.contains(names, latitude[rows], longitude[rows])
+
+    # Точки вне своего региона ищутся среди всех регионов
+    rest = np.flatnonzero(~missing & ~expected)
+    if len(rest):
+        located = polygons.locate(latitude[rest], longitude[rest])
+        outside = np.zeros(len(latitude), dtype=bool)
+        outside[rest[located < 0]] = True
+        if outside.any():
+            issues.append((outside, "coord: вне границ регионов России", "nulled", ("coord_w", "coord_l")))
+        elsewhere = np.zeros(len(latitude), dtype=bool)
+        elsewhere[rest[located >= 0]] = True
+        elsewhere &= known
+        if elsewhere.any():
+            issues.append((elsewhere, "coord: вне региона карточки", "flagged", ("coord_w", "coord_l")))
+    return issues
+
+def row_issues(issues):
+    """{номер строки: (причины, самое строгое действие)} только для строк с нарушениями"""
+    result = {}
+    for mask, reason, action, _ in issues:
+        for row in np.flatnonzero(mask).tolist():
+            reasons, worst = result.get(row, ([], action))
+            reasons.append(reason)
+            result[row] = (reasons, max(worst, action, key=ACTIONS.index))
+    return result
+
+def validate_dtp_rows(rows):
+    """
+    Проверка строк lbn.dtp_main пакета. Ошибочные значения "nulled" заменяются в строках на None.
+    Возвращает {номер строки: (причины, действие, строка до исправления)}.
+    """
+    if not rows:
+        return {}
+    columns = {column: as_float_array([row[column] for row in rows])
+               for column, _, _, _, _ in DTP_RULES if column != "dtp_date"}
+    columns["dtp_date"] = as_date_array([row["dtp_date"] for row in rows])
+    issues = check_ranges(columns, DTP_RULES)
+    # Дата в будущем (с запасом на часовые пояса) - ошибка источника
+    future = columns["dtp_date"] > np.datetime64(date.today() + timedelta(days=1))
+    if future.any():
+        issues.append((future, "dtp_date: в будущем", "dropped", "dtp_date"))
+
+    latitude = as_float_array([row["coord_w"] for row in rows])
+    longitude = as_float_array([row["coord_l"] for row in rows])
+    region_ids = np.array([str(row["region_id"]) for row in rows], dtype=object)
+    issues += check_dtp_coordinates(region_ids, latitude, longitude)
+
+    result = {row: (reasons, action, dict(rows[row])) for row, (reasons, action) in row_issues(issues).items()}
+    for mask, _, action, targets in issues:
+        if action == "nulled":
+            for row in np.flatnonzero(mask).tolist():
+                for column in (targets if isinstance(targets, tuple) else (targets,)):
+                    rows[row][column] = None
+    return result
+
+def validate_weather_columns(columns):
+    """
+    Проверка блока погоды: columns - имя переменной -> массив float.
+    Значения вне физических диапазонов заменяются на NaN (NULL при загрузке) в копии колонки.
+    Возвращает (новые колонки, {номер строки: (причины, действие)}).
+    """
+    issues = check_ranges(columns, WEATHER_RULES)
+    if not issues:
+        return columns, {}
+    columns = dict(columns)
+    for mask, _, action, column in issues:
+        if action == "nulled":
+            columns[column] = np.where(mask, np.nan, columns[column])
+    return columns, row_issues(issues)
+
+def json_safe(value):
+    """Значения строки для JSONB: float NaN/inf -> None (в словарях и списках тоже)"""
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def write_quarantine(cur, source, records):
+    """
+    Запись нарушений пакета в lbn.data_quarantine одним запросом.
+    records: (ключ строки dict, действие, причины, исходная строка dict).
+    """
+    if not records:
+        return 0
+    # NaN/inf - не JSON: PostgreSQL отклонит такой JSONB вместе со всей транзакцией загрузки
+    dumps = lambda value: json.dumps(json_safe(value), ensure_ascii=False, default=str, allow_nan=False)
+    execute_values(cur, """
+        INSERT INTO lbn.data_quarantine (source, record_key, action, reasons, payload)
+        VALUES %s
+    """, [(source, Json(key, dumps=dumps), action, reasons, Json(payload, dumps=dumps))
+          for key, action, reasons, payload in records], page_size=QUARANTINE_PAGE_SIZE)
+    logger.info(f"В карантин {source}: {len(records)} строк")
+    return len(records)
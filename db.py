@@ -0,0 +1,118 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DB_CONFIG = {
+    "user": os.getenv("user"),
+    "password": os.getenv("password"),
+    "host": os.getenv("host"),
+    "port": os.getenv("port"),
+    "dbname": os.getenv("dbname")
+}
+
+# Ошибки, после которых соединение может оказаться потерянным (см. connection_lost)
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Наследники OperationalError, которые относятся к запросу, а не к соединению:
+# взаимоблокировка, конфликт сериализации, отмена по statement_timeout
+QUERY_ERRORS = (psycopg2.extensions.TransactionRollbackError, psycopg2.extensions.QueryCanceledError)
+
+RETRIES = 3
+RETRY_BACKOFF_SECONDS = 2
+
+def connect(db_config=None, **kwargs):
+    """Новое соединение с настройками из .env; keepalive не дает NAT оборвать долгий простой"""
+    params = dict(db_config or DB_CONFIG)
+    params.setdefault("keepalives", 1)
+    params.setdefault("keepalives_idle", 30)
+    params.update(kwargs)
+    return psycopg2.connect(**params)
+
+def is_alive(conn):
+    """Проверка без запроса к серверу: закрытое или сломанное соединение не возвращается из пула"""
+    return not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+
+def connection_lost(error, conn):
+    """Ошибка означает разрыв соединения: соединение закрыто или в неизвестном состоянии"""
+    if isinstance(error, QUERY_ERRORS) or not isinstance(error, CONNECTION_ERRORS):
+        return False
+    return not is_alive(conn)
+
+class ReconnectingPool:
+    """
+    Пул соединений, который отбрасывает потерянные соединения и открывает новые.
+    run() повторяет функцию на свежем соединении при сетевой ошибке; функция
+    должна быть идемпотентной в пределах своей транзакции (что не закоммичено,
+    откатывается вместе с соединением).
+    """
+
+    def __init__(self, minconn=1, maxconn=4, db_config=None, retries=RETRIES, backoff=RETRY_BACKOFF_SECONDS):
+        params = dict(db_config or DB_CONFIG)
+        params.setdefault("keepalives", 1)
+        params.setdefault("keepalives_idle", 30)
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **params)
+        self.retries = retries
+        self.backoff = backoff
+
+    def getconn(self):
+        conn = self.pool.getconn()
+        while not is_alive(conn):
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+        return conn
+
+    def putconn(self, conn, broken=False):
+        if not broken and is_alive(conn) and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Незавершенная транзакция не должна достаться следующему пользователю
+            try:
+                conn.rollback()
+            except CONNECTION_ERRORS:
+                broken = True
+        self.pool.putconn(conn, close=broken or not is_alive(conn))
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except CONNECTION_ERRORS as e:
+            broken = connection_lost(e, conn)
+            raise
+        finally:
+            self.putconn(conn, broken)
+
+    def run(self, func, *args, **kwargs):
+        """
+        func(conn, *args, **kwargs) с повтором на новом соединении после разрыва.
+        Ошибки живого соединения (в том числе взаимоблокировки) не повторяются, а пробрасываются.
+        """
+        for attempt in range(1, self.retries + 1):
+            conn = None
+            lost = False
+            try:
+                # Новое соединение после разрыва может не открыться сразу: это тоже попытка с паузой
+                conn = self.getconn()
+                return func(conn, *args, **kwargs)
+            except CONNECTION_ERRORS as e:
+                lost = conn is None or connection_lost(e, conn)
+                if not lost or attempt == self.retries:
+                    raise
+                logger.warning(f"Разрыв соединения с БД ({e}), повтор {attempt}/{self.retries - 1}")
+            finally:
+                if conn is not None:
+                    self.putconn(conn, lost)
+            time.sleep(self.backoff * attempt)
+
+    def close(self):
+        self.pool.closeall()
@@ -1,135 +1,216 @@
-import requests
-from bs4 import BeautifulSoup
-from geopy.geocoders import Nominatim
-import time
+import argparse
 import csv
 import re
+import time
+
+from psycopg2.extras import execute_values
 
-# Настройка геокодера
-geolocator = Nominatim(user_agent="russian_cities_parser")
+from db import connect
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
 
-# Получаем данные с Википедии
-url = "https://ru.wikipedia.org/wiki/Список_городов_России"
-response = requests.get(url)
-soup = BeautifulSoup(response.text, 'html.parser')
+WIKI_URL = "https://ru.wikipedia.org/wiki/Список_городов_России"
+WITHOUT_COORDS_FILE = 'cities_without_coords.csv'
 
-# Находим таблицу с городами
-target_table = None
-for table in soup.find_all('table'):
-    headers = [th.get_text(strip=True) for th in table.find_all('th')]
-    if 'Город' in headers and 'Регион' in headers:
-        target_table = table
-        break
+# Поля города, которые берутся из таблицы Википедии
+CITY_FIELDS = ["city_name", "region", "federal_district", "population", "foundation_year", "status", "old_name"]
+# Поля, изменение которых делает город обновленным
+COMPARE_FIELDS = ["federal_district", "population", "foundation_year", "status", "old_name"]
 
-if not target_table:
-    raise ValueError("Таблица с городами не найдена")
+# Регулярные выражения очистки названий компилируются один раз
+NOT_RECOGNIZED_RE = re.compile(r'\s*не призн\.?')
+GLUED_NA_RE = re.compile(r'([а-яА-Я]+)(на)([А-Я][а-я]+)')
+GLUED_WORDS_RE = re.compile(r'([а-яА-Я]+)([А-Я][а-я]+)')
+NON_WORD_RE = re.compile(r'[^\w\s-]')
+NON_DIGIT_RE = re.compile(r'\D')
 
-# Функция для очистки названия города
 def clean_city_name(name):
     # Удаляем ненужные части строки, такие как "не призн."
-    name = re.sub(r'\s*не призн\.?', '', name).strip()
+    name = NOT_RECOGNIZED_RE.sub('', name).strip()
     # Исправляем случаи типа "АчхойМартан" на "Ачхой-Мартан"
-    name = re.sub(r'([а-яА-Я]+)([А-Я][а-я]+)', r'\1-\2', name)
+    name = GLUED_WORDS_RE.sub(r'\1-\2', name)
     # Исправляем случаи типа "СлавянскнаКубани" на "Славянск-на-Кубани"
-    name = re.sub(r'([а-яА-Я]+)(на)([А-Я][а-я]+)', r'\1-\2-\3', name)
-    name = re.sub(r'[^\w\s-]', '', name).strip()
+    name = GLUED_NA_RE.sub(r'\1-\2-\3', name)
+    name = NON_WORD_RE.sub('', name).strip()
     return name
 
-# Считываем существующие данные из файла и фильтруем города без координат
-existing_cities = {}
-try:
-    with open('russian_cities.csv', newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row['latitude'] and row['longitude']:  # Проверяем наличие координат
-                existing_cities[row['city_name']] = row
-except FileNotFoundError:
-    pass
-
-# Списки для новых городов и обновленных данных
-new_cities = []
-updated_cities = []
-
-# Обрабатываем каждую строку таблицы
-for row in target_table.find_all('tr')[1:]:
-    cols = row.find_all('td')
-    if len(cols) < 9:
-        continue
-
-    city_name = clean_city_name(cols[2].get_text(strip=True).split('[')[0].strip())
-    print(f"Обработка города: {city_name}")
-    region = cols[3].get_text(strip=True).split('[')[0].strip()
-    federal_district = cols[4].get_text(strip=True)
-    population = cols[5].get_text(strip=True).replace(' ', '')
-    foundation_year = cols[6].get_text(strip=True)
-    status = cols[7].get_text(strip=True)
-    old_name = cols[8].get_text(strip=True).replace('"', "'")
-
-    city_data = {
-        "city_name": city_name,
-        "region": region,
-        "federal_district": federal_district,
-        "population": population,
-        "foundation_year": foundation_year,
-        "status": status,
-        "old_name": old_name,
+def parse_population(population):
+    digits = NON_DIGIT_RE.sub('', population)
+    return int(digits) if digits else None
+
+def row_to_city(texts):
+    """Тексты ячеек строки таблицы -> словарь города или None для служебных строк"""
+    if len(texts) < 9:
+        return None
+    return {
+        "city_name": clean_city_name(texts[2].split('[')[0].strip()),
+        "region": texts[3].split('[')[0].strip(),
+        "federal_district": texts[4],
+        "population": parse_population(texts[5]),
+        "foundation_year": texts[6],
+        "status": texts[7],
+        "old_name": texts[8].replace('"', "'"),
     }
 
-    if city_name in existing_cities:
-        existing_cities[city_name].update({
-            "region": region,
-            "federal_district": federal_district,
-            "population": population,
-            "foundation_year": foundation_year,
-            "status": status,
-            "old_name": old_name
-        })
-        updated_cities.append(existing_cities[city_name])
+def parse_cities_lxml(html):
+    tree = lxml.html.fromstring(html)
+    tables = tree.xpath("//table[.//th[normalize-space()='Город'] and .//th[normalize-space()='Регион']]")
+    if not tables:
+        raise ValueError("Таблица с городами не найдена")
+    cities = []
+    for row in tables[0].iterfind('.//tr'):
+        # Склейка очищенных фрагментов текста, как get_text(strip=True) в BeautifulSoup
+        texts = [''.join(part.strip() for part in cell.itertext()) for cell in row.iterfind('td')]
+        city = row_to_city(texts)
+        if city:
+            cities.append(city)
+    return cities
+
+def parse_cities_bs4(html):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for table in soup.find_all('table'):
+        headers = [th.get_text(strip=True) for th in table.find_all('th')]
+        if 'Город' in headers and 'Регион' in headers:
+            break
     else:
-        new_cities.append(city_data)
-
-# Получаем координаты для новых городов
-cities_without_coords = []
-cities_with_coords = []
-
-for city in new_cities:
-    try:
-        print(f"Получение координат для города: {city['city_name']}")
-        location = geolocator.geocode(f"{city['city_name']}, {city['region']}, Россия", timeout=10)
-        time.sleep(1)
-        if location:
-            city['latitude'] = location.latitude
-            city['longitude'] = location.longitude
-            cities_with_coords.append(city)
-        else:
-            cities_without_coords.append(city)
-    except Exception as e:
-        print(f"Ошибка геокодирования для {city['city_name']}: {str(e)}")
-        cities_without_coords.append(city)
-
-# Записываем обновленные и новые данные обратно в основной файл
-with open('russian_cities.csv', 'w', newline='', encoding='utf-8') as csvfile:
-    fieldnames = [
-        "city_name", "region", "federal_district",
-        "population", "foundation_year", "status",
-        "old_name", "latitude", "longitude"
-    ]
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(updated_cities)
-    writer.writerows(cities_with_coords)
-
-# Записываем города без координат в отдельный файл
-with open('cities_without_coords.csv', 'w', newline='', encoding='utf-8') as csvfile:
-    fieldnames = [
-        "city_name", "region", "federal_district",
-        "population", "foundation_year", "status", "old_name"
-    ]
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(cities_without_coords)
-
-print("Готово! Данные обновлены в russian_cities.csv и города без координат сохранены в cities_without_coords.csv")
-
-
-
+        raise ValueError("Таблица с городами не найдена")
+    cities = []
+    for row in table.find_all('tr')[1:]:
+        city = row_to_city([td.get_text(strip=True) for td in row.find_all('td')])
+        if city:
+            cities.append(city)
+    return cities
+
+def parse_cities(html):
+    """Города из таблицы Википедии; lxml, если установлен, иначе BeautifulSoup"""
+    if lxml is not None:
+        return parse_cities_lxml(html)
+    return parse_cities_bs4(html)
+
+def load_existing(conn):
+    """Текущее содержимое lbn.city: (город, регион) -> словарь с координатами"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT city_name, region, federal_district, population, foundation_year, status, old_name,
+                latitude, longitude
+            FROM lbn.city
+        """)
+        columns = [desc[0] for desc in cur.description]
+        return {(row[0], row[1]): dict(zip(columns, row)) for row in cur}
+
+def diff_cities(cities, existing):
+    """
+    Сравнение таблицы Википедии с lbn.city.
+    Возвращает (changed, new): измененные города с координатами из базы и новые города.
+    """
+    changed, new = [], []
+    for city in cities:
+        current = existing.get((city["city_name"], city["region"]))
+        if current is None:
+            new.append(city)
+        elif any(city[field] != current[field] for field in COMPARE_FIELDS):
+            changed.append(dict(city, latitude=current["latitude"], longitude=current["longitude"]))
+    return changed, new
+
+def geocode(cities):
+    """Координаты для новых городов. Возвращает (с координатами, без координат)"""
+    from geopy.geocoders import Nominatim
+
+    geolocator = Nominatim(user_agent="russian_cities_parser")
+    with_coords, without_coords = [], []
+    for city in cities:
+        try:
+            print(f"Получение координат для города: {city['city_name']}")
+            location = geolocator.geocode(f"{city['city_name']}, {city['region']}, Россия", timeout=10)
+            time.sleep(1)
+            if location:
+                with_coords.append(dict(city, latitude=location.latitude, longitude=location.longitude))
+            else:
+                without_coords.append(city)
+        except Exception as e:
+            print(f"Ошибка геокодирования для {city['city_name']}: {str(e)}")
+            without_coords.append(city)
+    return with_coords, without_coords
+
+def write_changes(conn, changed, added):
+    """Только изменения: UPDATE по координатам и upsert новых городов"""
+    fields = CITY_FIELDS + ["latitude", "longitude"]
+    with conn.cursor() as cur:
+        if changed:
+            execute_values(cur, """
+                UPDATE lbn.city c SET
+                    federal_district = v.federal_district,
+                    population = v.population::INT,
+                    foundation_year = v.foundation_year,
+                    status = v.status,
+                    old_name = v.old_name,
+                    date_update = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v (city_name, region, federal_district, population, foundation_year,
+                    status, old_name, latitude, longitude)
+                WHERE c.latitude = v.latitude AND c.longitude = v.longitude
+            """, [[city[field] for field in fields] for city in changed])
+        if added:
+            execute_values(cur, """
+                INSERT INTO lbn.city (city_name, region, federal_district, population, foundation_year, status,
+                    old_name, latitude, longitude)
+                VALUES %s
+                ON CONFLICT (latitude, longitude) DO UPDATE SET
+                    city_name = EXCLUDED.city_name,
+                    region = EXCLUDED.region,
+                    federal_district = EXCLUDED.federal_district,
+                    population = EXCLUDED.population,
+                    foundation_year = EXCLUDED.foundation_year,
+                    status = EXCLUDED.status,
+                    old_name = EXCLUDED.old_name,
+                    date_update = CURRENT_TIMESTAMP
+            """, [[city[field] for field in fields] for city in added])
+    conn.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обновление lbn.city по списку городов России из Википедии.")
+    parser.add_argument("--html", help="Разобрать сохраненную страницу вместо загрузки с Википедии")
+    parser.add_argument("--dry_run", action="store_true", help="Только показать изменения, без геокодирования и записи")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.html:
+        with open(args.html, encoding='utf-8') as f:
+            html = f.read()
+    else:
+        import requests
+        html = requests.get(WIKI_URL, timeout=30).text
+
+    cities = parse_cities(html)
+    print(f"Городов в таблице Википедии: {len(cities)}")
+
+    with connect() as conn:
+        changed, new = diff_cities(cities, load_existing(conn))
+        print(f"Изменено: {len(changed)}, новых: {len(new)}")
+        for city in changed:
+            print(f"  изменен: {city['city_name']} ({city['region']})")
+        for city in new:
+            print(f"  новый: {city['city_name']} ({city['region']})")
+
+        if args.dry_run or not (changed or new):
+            return
+
+        added, without_coords = geocode(new)
+        write_changes(conn, changed, added)
+        print(f"Записано в lbn.city: обновлено {len(changed)}, добавлено {len(added)}")
+
+    # Города без координат нельзя записать в lbn.city (ключ - координаты)
+    with open(WITHOUT_COORDS_FILE, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=CITY_FIELDS)
+        writer.writeheader()
+        writer.writerows(without_coords)
+    print(f"Городов без координат: {len(without_coords)}, сохранены в {WITHOUT_COORDS_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import logging
+import time
+
+from db import CONNECTION_ERRORS, RETRIES, RETRY_BACKOFF_SECONDS, connect, connection_lost
+
+logger = logging.getLogger(__name__)
+
+# Категориальные колонки, которые при --encode_categories хранятся кодами словаря
+# в колонках <имя>_id; kind в lbn.dtp_dict совпадает с именем колонки
+ENCODED_COLUMNS = {
+    "lbn.dtp_main": [
+        "dtp_type", "road_category", "road_class", "road_condition", "lighting", "dtp_severity"
+    ],
+    "lbn.dtp_vehicles": [
+        "vehicle_status", "vehicle_type", "brand", "color", "drive_type", "damage",
+        "tech_condition", "ownership", "owner_type"
+    ],
+    "lbn.dtp_participants": [
+        "participant_type", "status", "gender", "alcohol", "safety_belt", "seat_group", "hidden_status"
+    ],
+}
+
+class LookupCache:
+    """
+    Кэш словаря lbn.dtp_dict в памяти: (kind, value) -> id.
+    Новые значения пишутся через отдельное соединение в autocommit, поэтому
+    откат транзакции карточки не оставляет в кэше id, которых нет в БД,
+    а параллельные воркеры не ждут друг друга на уникальном индексе.
+    После разрыва соединение открывается заново: запросы в autocommit можно повторить.
+    """
+
+    def __init__(self, db_config=None):
+        self.db_config = db_config
+        self.conn = None
+        self.ids = {}
+        self.connect()
+        self.preload()
+
+    def connect(self):
+        self.conn = connect(self.db_config)
+        self.conn.autocommit = True
+
+    def preload(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT kind, value, id FROM lbn.dtp_dict")
+            self.ids = {(kind, value): id for kind, value, id in cur}
+
+    def get_id(self, kind, value):
+        key = (kind, value)
+        id = self.ids.get(key)
+        if id is None:
+            id = self._fetch_or_insert(kind, value)
+            self.ids[key] = id
+        return id
+
+    def encode(self, kind, values):
+        return [self.get_id(kind, value) for value in values]
+
+    def encode_row(self, table, row):
+        """Заменяет категориальные строки в row кодами в колонках <имя>_id"""
+        for column in ENCODED_COLUMNS[table]:
+            value = row[column]
+            row[column + "_id"] = None if value is None else self.get_id(column, str(value))
+            row[column] = None
+        return row
+
+    def _fetch_or_insert(self, kind, value):
+        for attempt in range(1, RETRIES + 1):
+            try:
+                return self._query_id(kind, value)
+            except CONNECTION_ERRORS as e:
+                if not connection_lost(e, self.conn) or attempt == RETRIES:
+                    raise
+                logger.warning(f"Разрыв соединения словаря ({e}), повтор {attempt}/{RETRIES - 1}")
+            self.close()
+            time.sleep(RETRY_BACKOFF_SECONDS * attempt)
+            self.connect()
+
+    def _query_id(self, kind, value):
+        with self.conn.cursor() as cur:
+            # Значение мог добавить другой воркер после preload
+            cur.execute("SELECT id FROM lbn.dtp_dict WHERE kind = %s AND value = %s", (kind, value))
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("""
+                    INSERT INTO lbn.dtp_dict (kind, value) VALUES (%s, %s)
+                    ON CONFLICT (kind, value) DO NOTHING
+                    RETURNING id
+                """, (kind, value))
+                row = cur.fetchone()
+            if row is None:
+                cur.execute("SELECT id FROM lbn.dtp_dict WHERE kind = %s AND value = %s", (kind, value))
+                row = cur.fetchone()
+        return row[0]
+
+    def close(self):
+        if not self.conn.closed:
+            self.conn.close()
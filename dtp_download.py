@@ -1,13 +1,19 @@
-import requests
 import json
+import re
 import psycopg2
+from psycopg2.extras import execute_values
 from datetime import datetime, timedelta
 import time
 import logging
 import argparse
-from dotenv import load_dotenv
 import sys
-import os
+from db import ReconnectingPool
+from gibdd_cache import ResponseCache, month_ttl
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Настройка логов
 logging.basicConfig(
@@ -17,30 +23,158 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
 
-# Загрузка настроек
-load_dotenv()
-
-# Параметры подключения
-DB_PARAMS = {
-    "dbname": os.getenv("dbname"),
-    "user": os.getenv("user"),
-    "password": os.getenv("password"),
-    "host": os.getenv("host"),
-    "port": os.getenv("port")
-}
-
 # Список городов
 CITIES = [
     {"name": "Лобня", "region_id": "46", "district_id": "46440"},
     {"name": "Калининград", "region_id": "27", "district_id": "27401"}
 ]
 
+API_URL = "http://stat.gibdd.ru/map/getDTPCardData"
+HEADERS = {
+    "User-Agent": "Mozilla/5.0",
+    "Content-Type": "application/json"
+}
+
+# Размер страницы для пакетной вставки в буфер
+INSERT_PAGE_SIZE = 200
+
+# Записей в одном ответе API (параметр en): список записей месяца ограничен этим числом
+RECORDS_PER_REQUEST = 1000
+
+# Следующая структурная скобка JSON; строки (вместе со скобками внутри них) пропускаются целиком
+BRACKET_RE = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])')
+TAB_KEY_RE = re.compile(r'"tab"\s*:\s*$')
+
+def loads(data):
+    """Разбор JSON: orjson, если установлен, иначе стандартный json"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def iter_tab_records(text):
+    """
+    Отдает исходный текст каждой записи массива "tab" из ответа API.
+    Записи не разбираются в словари и не сериализуются повторно:
+    в буфер уходит срез исходной строки.
+    ValueError, если data - не объект JSON, в нем нет "tab" или ответ оборван.
+    """
+    if not isinstance(text, str) or not text.lstrip().startswith('{'):
+        raise ValueError(f"поле data - не объект JSON: {str(text)[:100]!r}")
+    depth = 0
+    in_tab = False
+    start = 0
+    pos = 0
+    while True:
+        match = BRACKET_RE.match(text, pos)
+        if not match:
+            # Скобки кончились раньше конца массива: ответ обрезан, и хвост записей пропал бы молча
+            raise ValueError("ответ оборван внутри tab" if in_tab else "ответ оборван")
+        pos = match.end()
+        bracket = match.group(1)
+        bracket_pos = match.start(1)
+
+        if bracket in '[{':
+            depth += 1
+            if in_tab and depth == 3 and bracket == '{':
+                start = bracket_pos
+            elif depth == 2 and bracket == '[' and TAB_KEY_RE.search(text, match.start(), bracket_pos):
+                in_tab = True
+        else:
+            if in_tab and depth == 3 and bracket == '}':
+                yield text[start:pos]
+            elif in_tab and depth == 2:
+                return
+            elif depth == 1:
+                raise ValueError("нет массива tab в поле data")
+            depth -= 1
+
+def build_payload(city, year, month):
+    return {
+        "data": json.dumps({
+            "date": [f"MONTHS:{month}.{year}"],
+            "ParReg": city["region_id"],
+            "order": {"type": "1", "fieldName": "dat"},
+            "reg": city["district_id"],
+            "ind": "1",
+            "st": "1",
+            "en": str(RECORDS_PER_REQUEST),
+            "fil": {"isSummary": False},
+            "fieldNames": ["dat", "time", "coordinates", "infoDtp"]
+        }, separators=(',', ':'))
+    }
+
+def fetch_records(body):
+    """
+    Разбирает тело ответа API и возвращает список записей ДТП в виде JSON-строк.
+    Возвращает None, если ответ некорректен.
+    """
+    try:
+        response_json = loads(body)
+    except ValueError as e:
+        logger.warning(f"Невалидный JSON в ответе: {e}")
+        return None
+
+    if not isinstance(response_json, dict) or "data" not in response_json:
+        logger.warning("Нет поля 'data' в ответе API")
+        return None
+
+    # Весь ответ проверяется до записи: оборванный tab не должен попасть ни в буфер, ни в кэш.
+    # Поэтому записи собираются в список, а не идут в буфер потоком; это не больше RECORDS_PER_REQUEST
+    # срезов уже прочитанного тела, и повтор после разрыва соединения пишет их заново целиком
+    try:
+        return list(iter_tab_records(response_json["data"]))
+    except ValueError as e:
+        logger.warning(f"Некорректное поле 'data' в ответе API: {e}")
+        return None
+
+def write_buffer(conn, city, records):
+    """Пишет записи в lbn.dtp_buffer страницами, возвращает число вставленных записей"""
+    count = 0
+
+    def rows():
+        nonlocal count
+        for json_str in records:
+            count += 1
+            yield (city["name"], city["region_id"], city["district_id"], json_str)
+
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO lbn.dtp_BUFFER
+            (city_name, region_id, district_id, raw_json)
+            VALUES %s
+            """,
+            rows(),
+            page_size=INSERT_PAGE_SIZE
+        )
+    return count
+
+def store_records(conn, city, records):
+    """Запись ответа в буфер одной транзакцией (повторяется целиком после разрыва соединения)"""
+    try:
+        inserted = write_buffer(conn, city, records)
+    except psycopg2.Error as e:
+        logger.error(f"Ошибка вставки записей: {e}")
+        conn.rollback()
+        raise
+    conn.commit()
+    return inserted
+
+def truncate_buffer(conn):
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE TABLE lbn.dtp_BUFFER")
+    conn.commit()
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Загрузка данных о ДТП за указанный период.")
     parser.add_argument("--start_year", type=int, help="Начальный год (по умолчанию: текущий год - 2 месяца)")
     parser.add_argument("--start_month", type=int, help="Начальный месяц (по умолчанию: текущий месяц - 2)")
     parser.add_argument("--end_year", type=int, help="Конечный год (по умолчанию: текущий год)")
     parser.add_argument("--end_month", type=int, help="Конечный месяц (по умолчанию: текущий месяц)")
+    parser.add_argument("--replay", action="store_true",
+                        help="Пересобрать lbn.dtp_buffer из всех сохраненных ответов без обращения к API")
+    parser.add_argument("--no_cache", action="store_true", help="Не читать ответы из кэша (запись в кэш сохраняется)")
     return parser.parse_args()
 
 def get_date_range(args):
@@ -63,128 +197,120 @@ def get_date_range(args):
 
     return start_year, start_month, end_year, end_month
 
+def get_body(cache, city, year, month, args):
+    """
+    Тело ответа API за месяц: из кэша, если он еще действителен, иначе из сети.
+    Возвращает (body, from_cache); body = None, если получить ответ не удалось.
+    """
+    payload = build_payload(city, year, month)
+    if args.replay or not args.no_cache:
+        ttl = None if args.replay else month_ttl(year, month)
+        body = cache.get(API_URL, payload, ttl)
+        if body is not None or args.replay:
+            return body, True
+
+    # requests импортируется только при обращении к сети: replay работает без него
+    import requests
+    try:
+        response = requests.post(API_URL, json=payload, headers=HEADERS, timeout=30)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Ошибка запроса: {e}")
+        return None, False
+
+    # Проверка ответа
+    if response.status_code != 200:
+        logger.warning(f"Ошибка HTTP: {response.status_code}")
+        return None, False
+    return response.content, False
+
+def get_jobs(cache, args):
+    """Список (город, год, месяц) для загрузки"""
+    if args.replay:
+        jobs = {}
+        for meta in cache.entries():
+            city = meta.get("city")
+            if city in CITIES:
+                jobs[(city["name"], meta["year"], meta["month"])] = (city, meta["year"], meta["month"])
+        return [jobs[key] for key in sorted(jobs)]
+
+    start_year, start_month, end_year, end_month = get_date_range(args)
+    logger.info(f"Загрузка данных с {start_month}.{start_year} по {end_month}.{end_year}")
+
+    jobs = []
+    for city in CITIES:
+        for year in range(start_year, end_year + 1):
+            start_m = start_month if year == start_year else 1
+            end_m = end_month if year == end_year else 12
+            for month in range(start_m, end_m + 1):
+                jobs.append((city, year, month))
+    return jobs
+
 def main():
     args = parse_args()
-    start_year, start_month, end_year, end_month = get_date_range(args)
+    cache = ResponseCache()
+    jobs = get_jobs(cache, args)
 
-    logger.info(f"Загрузка данных с {start_month}.{start_year} по {end_month}.{end_year}")
+    if args.replay:
+        # Без сохраненных ответов пересобирать нечего: очистка оставила бы буфер пустым
+        if not jobs:
+            logger.error("Режим replay: в кэше нет сохраненных ответов, буфер не тронут")
+            sys.exit(1)
+        logger.info(f"Режим replay: {len(jobs)} сохраненных ответов, буфер будет пересобран")
 
-    # Подключение к БД
+    # Подключение к БД: пул из одного соединения, которое пересоздается после разрыва
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
+        pool = ReconnectingPool(1, 1)
         logger.info("Успешное подключение к БД")
     except Exception as e:
         logger.error(f"Ошибка подключения к БД: {e}")
         sys.exit(1)
 
     try:
-        for city in CITIES:
-            logger.info(f"Обработка города: {city['name']}")
-
-            for year in range(start_year, end_year + 1):
-                start_m = start_month if year == start_year else 1
-                end_m = end_month if year == end_year else 12
-
-                for month in range(start_m, end_m + 1):
-                    logger.info(f"Загрузка данных за {month}.{year}...")
-
-                    # Формируем запрос к API
-                    payload = {
-                        "data": json.dumps({
-                            "date": [f"MONTHS:{month}.{year}"],
-                            "ParReg": city["region_id"],
-                            "order": {"type": "1", "fieldName": "dat"},
-                            "reg": city["district_id"],
-                            "ind": "1",
-                            "st": "1",
-                            "en": "1000",
-                            "fil": {"isSummary": False},
-                            "fieldNames": ["dat", "time", "coordinates", "infoDtp"]
-                        }, separators=(',', ':'))
-                    }
-
-                    headers = {
-                        "User-Agent": "Mozilla/5.0",
-                        "Content-Type": "application/json"
-                    }
-
-                    # Запрос к API
-                    try:
-                        response = requests.post(
-                            "http://stat.gibdd.ru/map/getDTPCardData",
-                            json=payload,
-                            headers=headers,
-                            timeout=30
-                        )
-
-                        # Проверка ответа
-                        if response.status_code != 200:
-                            logger.warning(f"Ошибка HTTP: {response.status_code}")
-                            continue
-
-                        try:
-                            response_json = response.json()
-                            if "data" not in response_json:
-                                logger.warning("Нет поля 'data' в ответе API")
-                                continue
-
-                            data = json.loads(response_json["data"]).get("tab", [])
-                        except json.JSONDecodeError as e:
-                            logger.warning(f"Невалидный JSON в ответе: {e}")
-                            continue
-
-                        if not data:
-                            logger.info("Нет данных для загрузки")
-                            continue
-
-                        # Вставка в БД с новыми полями
-                        try:
-                            with conn.cursor() as cur:
-                                for record in data:
-                                    try:
-                                        json_str = json.dumps(record, ensure_ascii=False)
-
-                                        # Добавляем информацию о городе в INSERT
-                                        cur.execute(
-                                            """
-                                            INSERT INTO lbn.dtp_BUFFER
-                                            (city_name, region_id, district_id, raw_json)
-                                            VALUES (%s, %s, %s, %s)
-                                            """,
-                                            (
-                                                city["name"],
-                                                city["region_id"],
-                                                city["district_id"],
-                                                json_str
-                                            )
-                                        )
-                                    except psycopg2.Error as e:
-                                        logger.error(f"Ошибка вставки записи: {e}")
-                                        conn.rollback()
-                                        raise
-
-                                conn.commit()
-                                logger.info(f"Успешно добавлено {len(data)} записей")
-
-                        except psycopg2.InterfaceError:
-                            logger.error("Разрыв соединения с БД. Переподключение...")
-                            conn = psycopg2.connect(**DB_PARAMS)
-                            continue
-
-                    except requests.exceptions.RequestException as e:
-                        logger.error(f"Ошибка запроса: {e}")
-                        continue
-
-                    time.sleep(1)  # Пауза между запросами
+        if args.replay:
+            pool.run(truncate_buffer)
+
+        current_city = None
+        for city, year, month in jobs:
+            if city is not current_city:
+                current_city = city
+                logger.info(f"Обработка города: {city['name']}")
+
+            logger.info(f"Загрузка данных за {month}.{year}...")
+
+            # Запрос к API или чтение из кэша
+            body, from_cache = get_body(cache, city, year, month, args)
+
+            if body is None:
+                if args.replay:
+                    logger.warning("Нет сохраненного ответа")
+                continue
+
+            records = fetch_records(body)
+            if records is None:
+                continue
+
+            # В кэш попадают только ответы, прошедшие проверку fetch_records целиком:
+            # обрезанный или ошибочный ответ иначе отдавался бы из кэша до конца TTL (в replay - всегда)
+            if not from_cache:
+                cache.put(API_URL, build_payload(city, year, month), body, city=city, year=year, month=month)
+
+            # Вставка в БД с новыми полями; после разрыва соединения месяц пишется заново
+            inserted = pool.run(store_records, city, records)
+            if inserted:
+                logger.info(f"Успешно добавлено {inserted} записей" + (" (из кэша)" if from_cache else ""))
+            else:
+                logger.info("Нет данных для загрузки")
+
+            if not from_cache:
+                time.sleep(1)  # Пауза между запросами
 
     except KeyboardInterrupt:
         logger.info("Скрипт остановлен вручную")
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}", exc_info=True)
     finally:
-        if 'conn' in locals() and not conn.closed:
-            conn.close()
-            logger.info("Соединение с БД закрыто")
+        pool.close()
+        logger.info("Соединение с БД закрыто")
 
     logger.info("Работа скрипта завершена")
 
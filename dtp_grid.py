@@ -0,0 +1,227 @@
+import argparse
+from datetime import date
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from db import connect
+
+# Геохеш карточки хранится в lbn.dtp_main с этой точностью (~38 x 19 м);
+# ячейки сетки - его префиксы, поэтому пересчет ячейки - диапазон по индексу
+GEOHASH_PRECISION = 8
+
+# Уровни сетки lbn.dtp_grid: 4 - ~39 x 20 км (город), 5 - ~5 км (район),
+# 6 - ~1.2 x 0.6 км (квартал), 7 - ~150 м (перекресток)
+GRID_PRECISIONS = [4, 5, 6, 7]
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Классы погоды по значениям s_pog карточки в порядке приоритета: первое совпадение
+# по подстроке определяет класс ("Пасмурно, Дождь" - дождь)
+WEATHER_CLASSES = [
+    ("снег", ["снег", "метель"]),
+    ("дождь", ["дожд", "ливень"]),
+    ("туман", ["туман"]),
+    ("ветер", ["ветер"]),
+    ("жара/мороз", ["температура"]),
+    ("пасмурно", ["пасмурн"]),
+    ("ясно", ["ясно"]),
+]
+WEATHER_UNKNOWN = "нет данных"
+WEATHER_OTHER = "прочее"
+
+UPDATE_PAGE_SIZE = 1000
+
+def weather_class(values):
+    """Список значений s_pog (или строка через запятую) -> класс погоды"""
+    text = (values if isinstance(values, str) else ', '.join(map(str, values or []))).lower()
+    if not text.strip():
+        return WEATHER_UNKNOWN
+    for name, keywords in WEATHER_CLASSES:
+        if any(keyword in text for keyword in keywords):
+            return name
+    return WEATHER_OTHER
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Векторное кодирование геохеша; для пустых координат (NaN) - None"""
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    valid = ~(np.isnan(latitude) | np.isnan(longitude))
+    bits = precision * 5
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    # Номер полосы по каждой оси; биты чередуются начиная с долготы
+    lat_index = np.clip(((np.nan_to_num(latitude) + 90) / 180 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1)
+    lon_index = np.clip(((np.nan_to_num(longitude) + 180) / 360 * (1 << lon_bits)).astype(np.int64), 0, (1 << lon_bits) - 1)
+    code = np.zeros(len(latitude), dtype=np.int64)
+    for bit in range(bits):
+        if bit % 2 == 0:
+            value = (lon_index >> (lon_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_index >> (lat_bits - 1 - bit // 2)) & 1
+        code = (code << 1) | value
+    # Группы по 5 бит -> символы base32, строка ячейки собирается видом байтов без цикла по точкам
+    alphabet = np.frombuffer(BASE32.encode(), dtype=np.uint8)
+    digits = np.stack([alphabet[(code >> (5 * (precision - 1 - i))) & 31] for i in range(precision)], axis=1)
+    cells = np.ascontiguousarray(digits).view(f"S{precision}").ravel().astype(str)
+    return [cell if ok else None for cell, ok in zip(cells.tolist(), valid.tolist())]
+
+def cell_bounds(cell):
+    """Ячейка -> (широта мин, широта макс, долгота мин, долгота макс) для отрисовки на карте"""
+    lat_min, lat_max, lon_min, lon_max = -90.0, 90.0, -180.0, 180.0
+    is_lon = True
+    for char in cell:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if is_lon:
+                middle = (lon_min + lon_max) / 2
+                lon_min, lon_max = (middle, lon_max) if bit else (lon_min, middle)
+            else:
+                middle = (lat_min + lat_max) / 2
+                lat_min, lat_max = (middle, lat_max) if bit else (lat_min, middle)
+            is_lon = not is_lon
+    return lat_min, lat_max, lon_min, lon_max
+
+def assign_cells(rows):
+    """Геохеш для строк lbn.dtp_main пакета (после проверки координат) одним вызовом numpy"""
+    latitude = [np.nan if row["coord_w"] is None else row["coord_w"] for row in rows]
+    longitude = [np.nan if row["coord_l"] is None else row["coord_l"] for row in rows]
+    for row, cell in zip(rows, encode_geohash(latitude, longitude)):
+        row["geohash"] = cell
+
+def touched_cells(keys):
+    """(геохеш, дата ДТП) карточек -> отсортированные ключи ячеек (точность, ячейка, месяц)"""
+    cells = set()
+    for geohash, dtp_date in keys:
+        if geohash is None or dtp_date is None:
+            continue
+        month = dtp_date.replace(day=1)
+        for precision in GRID_PRECISIONS:
+            cells.add((precision, geohash[:precision], month))
+    return sorted(cells)
+
+# Пересчет ячеек из lbn.dtp_main. Рекомендательная блокировка до конца транзакции
+# не дает двум воркерам пересчитывать сетку одновременно: иначе второй удалил бы
+# не все строки ячейки (новые строки первого не видны его снимку) и упал на ключе
+REFRESH_SQL = """
+    SELECT pg_advisory_xact_lock(hashtext('lbn.dtp_grid'));
+    DELETE FROM lbn.dtp_grid g
+    USING (VALUES {cells}) AS t(precision, cell, month)
+    WHERE g.precision = t.precision AND g.cell = t.cell AND g.month = t.month;
+    INSERT INTO lbn.dtp_grid (precision, cell, month, weather_class, accidents, deaths, wounded)
+    SELECT t.precision, t.cell, t.month, m.weather_class, COUNT(*), SUM(m.deaths), SUM(m.wounded)
+    FROM (VALUES {cells}) AS t(precision, cell, month)
+    JOIN lbn.dtp_main m
+        ON m.geohash >= t.cell AND m.geohash < t.cell || '~'
+        AND m.dtp_date >= t.month AND m.dtp_date < t.month + INTERVAL '1 month'
+    GROUP BY t.precision, t.cell, t.month, m.weather_class;
+"""
+
+def refresh_cells(cur, keys):
+    """
+    Пересчет ячеек сетки, затронутых карточками (старые и новые значения геохеша и даты).
+    Все запросы уходят одним обменом с сервером; возвращает число ячеек.
+    """
+    cells = touched_cells(keys)
+    if not cells:
+        return 0
+    values = ','.join(cur.mogrify("(%s::SMALLINT, %s::VARCHAR, %s::DATE)", cell).decode('utf-8') for cell in cells)
+    cur.execute(REFRESH_SQL.format(cells=values))
+    return len(cells)
+
+def backfill(conn):
+    """Геохеш и класс погоды для карточек, загруженных до появления сетки"""
+    with conn.cursor() as cur:
+        # Текст погоды берется из представления: при хранении массивами колонка weather пуста
+        cur.execute("""
+            SELECT m.kart_id, m.region_id, m.district_id, m.coord_w, m.coord_l, v.weather
+            FROM lbn.dtp_main m
+            JOIN lbn.v_dtp_main v USING (kart_id, region_id, district_id)
+            WHERE m.weather_class IS NULL
+        """)
+        rows = cur.fetchall()
+        if not rows:
+            return 0
+        # 0/0 - подстановка parse_float при пустых координатах, а не точка
+        latitude = [np.nan if not row[3] and not row[4] else row[3] for row in rows]
+        longitude = [np.nan if not row[3] and not row[4] else row[4] for row in rows]
+        cells = encode_geohash(latitude, longitude)
+        execute_values(cur, """
+            UPDATE lbn.dtp_main m
+            SET geohash = v.geohash, weather_class = v.weather_class
+            FROM (VALUES %s) AS v(kart_id, region_id, district_id, geohash, weather_class)
+            WHERE m.kart_id = v.kart_id AND m.region_id = v.region_id AND m.district_id = v.district_id
+        """, [(row[0], row[1], row[2], cell, weather_class(row[5])) for row, cell in zip(rows, cells)],
+            page_size=UPDATE_PAGE_SIZE)
+    conn.commit()
+    return len(rows)
+
+def rebuild(conn):
+    """Полная пересборка lbn.dtp_grid из lbn.dtp_main"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('lbn.dtp_grid'))")
+        cur.execute("TRUNCATE TABLE lbn.dtp_grid")
+        cur.execute("""
+            INSERT INTO lbn.dtp_grid (precision, cell, month, weather_class, accidents, deaths, wounded)
+            SELECT p.precision, LEFT(m.geohash, p.precision), DATE_TRUNC('month', m.dtp_date)::DATE,
+                m.weather_class, COUNT(*), SUM(m.deaths), SUM(m.wounded)
+            FROM lbn.dtp_main m
+            CROSS JOIN UNNEST(%s::SMALLINT[]) AS p(precision)
+            WHERE m.geohash IS NOT NULL AND m.dtp_date IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+        """, (GRID_PRECISIONS,))
+        cells = cur.rowcount
+    conn.commit()
+    return cells
+
+def hotspots(conn, precision, date_from, date_to, weather_classes=None, limit=20):
+    """Самые аварийные ячейки за период [date_from, date_to) по готовой сетке"""
+    condition = "AND weather_class = ANY(%(classes)s)" if weather_classes else ""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT cell, SUM(accidents), SUM(deaths), SUM(wounded)
+            FROM lbn.dtp_grid
+            WHERE precision = %(precision)s AND month >= %(date_from)s AND month < %(date_to)s
+            {condition}
+            GROUP BY cell
+            ORDER BY 2 DESC, 3 DESC
+            LIMIT %(limit)s
+        """, {"precision": precision, "date_from": date_from.replace(day=1), "date_to": date_to,
+              "classes": weather_classes, "limit": limit})
+        return cur.fetchall()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сетка очагов ДТП по геохешу (lbn.dtp_grid).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("backfill", help="Заполнить геохеш и класс погоды старых карточек и пересобрать сетку")
+    subparsers.add_parser("rebuild", help="Пересобрать сетку целиком")
+    top_parser = subparsers.add_parser("top", help="Самые аварийные ячейки")
+    top_parser.add_argument("--precision", type=int, choices=GRID_PRECISIONS, default=6,
+                            help="Уровень сетки (по умолчанию: 6, ~1 км)")
+    top_parser.add_argument("--date_from", type=date.fromisoformat, default=date(2015, 1, 1),
+                            help="Начало периода, ГГГГ-ММ-ДД")
+    top_parser.add_argument("--date_to", type=date.fromisoformat, default=date.today(),
+                            help="Конец периода (не включая), ГГГГ-ММ-ДД")
+    top_parser.add_argument("--weather", nargs="+",
+                            choices=[name for name, _ in WEATHER_CLASSES] + [WEATHER_OTHER, WEATHER_UNKNOWN],
+                            help="Только эти классы погоды")
+    top_parser.add_argument("--limit", type=int, default=20)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with connect() as conn:
+        if args.command == "backfill":
+            print(f"Карточек дополнено: {backfill(conn)}")
+        if args.command in ("backfill", "rebuild"):
+            print(f"Ячеек в сетке: {rebuild(conn)}")
+        else:
+            rows = hotspots(conn, args.precision, args.date_from, args.date_to, args.weather, args.limit)
+            print(f"{'ячейка':<10} {'центр':>22} {'ДТП':>6} {'погибло':>8} {'ранено':>7}")
+            for cell, accidents, deaths, wounded in rows:
+                lat_min, lat_max, lon_min, lon_max = cell_bounds(cell)
+                center = f"{(lat_min + lat_max) / 2:.4f}, {(lon_min + lon_max) / 2:.4f}"
+                print(f"{cell:<10} {center:>22} {accidents:>6} {deaths:>8} {wounded:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+from collections import Counter
+from datetime import date, time
+from functools import lru_cache
+
+# Счетчики ошибок разбора по полям карточки: сколько раз вместо значения подставлен 0/None
+parse_errors = Counter()
+
+# Ошибки, которые означают "значение не разбирается", а не ошибку в коде
+PARSE_EXCEPTIONS = (ValueError, TypeError, AttributeError)
+
+@lru_cache(maxsize=4096)
+def _parse_date(date_str):
+    # Формат ДД.ММ.ГГГГ; даты в пределах месяца сильно повторяются, поэтому кэшируем
+    day, month, year = date_str.split('.')
+    return date(int(year), int(month), int(day))
+
+@lru_cache(maxsize=2048)
+def _parse_time(time_str):
+    # Формат ЧЧ:ММ, всего 1440 возможных значений
+    hour, minute = time_str.split(':')
+    return time(int(hour), int(minute))
+
+def parse_date(date_str, field='date'):
+    if not date_str:
+        return None
+    try:
+        return _parse_date(date_str)
+    except PARSE_EXCEPTIONS:
+        parse_errors[field] += 1
+        return None
+
+def parse_time(time_str, field='Time'):
+    if not time_str:
+        return None
+    try:
+        return _parse_time(time_str)
+    except PARSE_EXCEPTIONS:
+        parse_errors[field] += 1
+        return None
+
+def parse_int(value, field='int'):
+    if value is None:
+        return 0
+    if type(value) is int:
+        return value
+    try:
+        return int(value)
+    except PARSE_EXCEPTIONS:
+        parse_errors[field] += 1
+        return 0
+
+def parse_float(value, field='float'):
+    if value is None:
+        return 0.0
+    if type(value) is float:
+        return value
+    try:
+        if type(value) is str and ',' in value:
+            value = value.replace(',', '.')
+        return float(value)
+    except PARSE_EXCEPTIONS:
+        parse_errors[field] += 1
+        return 0.0
+
+def _parse_many(parser, values, field):
+    # Каждое уникальное значение разбирается один раз на пакет; ошибка считается при каждом повторе
+    parsed = {}
+    result = []
+    for value in values:
+        try:
+            result.append(parsed[value])
+            if result[-1] is None and value:
+                parse_errors[field] += 1
+        except KeyError:
+            parsed[value] = parser(value, field)
+            result.append(parsed[value])
+        except TypeError:
+            result.append(parser(value, field))
+    return result
+
+def parse_dates(values, field='date'):
+    """Разбор списка дат целым пакетом"""
+    return _parse_many(parse_date, values, field)
+
+def parse_times(values, field='Time'):
+    """Разбор списка времен целым пакетом"""
+    return _parse_many(parse_time, values, field)
@@ -1,10 +1,16 @@
 import json
 import psycopg2
-from psycopg2 import pool
-from datetime import datetime
-from dotenv import load_dotenv
-import os
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 import logging
+from dtp_parsers import parse_date, parse_time, parse_dates, parse_times, parse_int, parse_float, parse_errors
+from dtp_dictionary import LookupCache
+from db import DB_CONFIG, ReconnectingPool, connection_lost
+from data_validation import validate_dtp_rows, write_quarantine
+from dtp_grid import assign_cells, refresh_cells, weather_class
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,254 +21,515 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Загрузка настроек
-load_dotenv()
-DB_CONFIG = {
-    "dbname": os.getenv("dbname"),
-    "user": os.getenv("user"),
-    "password": os.getenv("password"),
-    "host": os.getenv("host"),
-    "port": os.getenv("port")
-}
-
-def parse_date(date_str):
+# Таблицы карточки в порядке записи; True - date_update = CURRENT_TIMESTAMP при вставке
+CARD_TABLES = [
+    ("lbn.dtp_main", False),
+    ("lbn.dtp_vehicles", True),
+    ("lbn.dtp_participants", True),
+    ("lbn.dtp_factors", True),
+    ("lbn.dtp_objects", True),
+]
+
+# Строк в одном запросе execute_values при пакетной записи
+WRITE_PAGE_SIZE = 1000
+
+# Через сколько минут незавершенный захват пакета (например, после падения воркера) снимается
+CLAIM_TIMEOUT_MINUTES = 30
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Разбор lbn.dtp_buffer в таблицы ДТП.")
+    parser.add_argument("--workers", type=int, default=1, help="Число параллельных процессов (по умолчанию: 1)")
+    parser.add_argument("--batch_size", type=int, default=1000, help="Размер захватываемого пакета (по умолчанию: 1000)")
+    parser.add_argument("--child_storage", choices=["rows", "arrays"], default="rows",
+                        help="Хранение факторов, объектов и погоды: строками в дочерних таблицах (rows) "
+                             "или массивами кодов в lbn.dtp_main по словарю lbn.dtp_dict (arrays)")
+    parser.add_argument("--encode_categories", action="store_true",
+                        help="Хранить категориальные строки ДТП кодами словаря lbn.dtp_dict "
+                             "(текст доступен через представления lbn.v_dtp_*)")
+    return parser.parse_args()
+
+def claim_batch(conn, batch_size):
+    """
+    Захватывает пакет необработанных записей буфера.
+    FOR UPDATE SKIP LOCKED не дает двум воркерам взять одни и те же строки,
+    а отметка date_claim сохраняет захват после коммита.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE lbn.dtp_buffer
+            SET date_claim = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id
+                FROM lbn.dtp_buffer
+                WHERE date_processing IS NULL
+                AND is_error = FALSE
+                AND (date_claim IS NULL OR date_claim < CURRENT_TIMESTAMP - %s * INTERVAL '1 minute')
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, region_id, district_id, raw_json, city_name
+        """, (CLAIM_TIMEOUT_MINUTES, batch_size))
+        rows = cur.fetchall()
+    conn.commit()
+    return sorted(rows, key=lambda row: row[0])
+
+def decode_raw_json(raw_json):
+    """Приводит raw_json к списку карточек, ValueError при неверном формате"""
+    if isinstance(raw_json, dict):
+        return [raw_json]
     try:
-        return datetime.strptime(date_str, '%d.%m.%Y').date() if date_str else None
-    except:
+        data_list = json.loads(raw_json)
+    except json.JSONDecodeError:
+        raise ValueError("Ошибка парсинга JSON")
+    if isinstance(data_list, dict):
+        return [data_list]
+    if not isinstance(data_list, list):
+        raise ValueError("Некорректный формат JSON")
+    return data_list
+
+def insert_row(cur, table, row, stamp=False):
+    columns = ', '.join(row)
+    placeholders = ', '.join(['%s'] * len(row))
+    if stamp:
+        columns += ', date_update'
+        placeholders += ', CURRENT_TIMESTAMP'
+    cur.execute(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", tuple(row.values()))
+
+def describe(item):
+    return ', '.join(item) if isinstance(item, list) else str(item)
+
+class CardPlan:
+    """Строки одной карточки по таблицам и номера машин, участники которых перезаписываются"""
+
+    def __init__(self, key, buffer_id=None):
+        self.key = key
+        self.buffer_id = buffer_id
+        self.rows = {table: [] for table, _ in CARD_TABLES}
+        self.participant_vehicles = []
+
+def build_card(buffer_id, data, region_id, district_id, city_name,
+               lookup=None, child_storage="rows", encode_categories=False, when=None):
+    """
+    Разбирает одну карточку в CardPlan без обращения к таблицам ДТП (None - карточка пропущена).
+    child_storage="arrays": факторы, объекты и погода пишутся массивами id словаря в lbn.dtp_main.
+    encode_categories: категориальные строки пишутся кодами словаря (см. ENCODED_COLUMNS).
+    when: (дата, время) карточки, уже разобранные для всего пакета; None - разбор здесь.
+    """
+    if not isinstance(data, dict):
+        logger.error(f"Некорректный формат данных для {buffer_id}: {data}")
         return None
 
-def parse_time(time_str):
-    try:
-        return datetime.strptime(time_str, '%H:%M').time() if time_str else None
-    except:
+    kart_id = data.get('KartId')
+    if not kart_id:
+        logger.warning(f"Пропуск: нет KartId для {buffer_id}")
         return None
 
-def parse_int(value):
+    plan = CardPlan((kart_id, region_id, district_id), buffer_id)
+
+    info = data.get('infoDtp', {})
+
+    # Обработка dtp_main
+    if when is None:
+        when = parse_date(data.get('date'), 'date'), parse_time(data.get('Time'), 'Time')
+    dtp_date, dtp_time = when
+    settlement = info.get('n_p', city_name)
+
+    main_row = {
+        "kart_id": kart_id,
+        "region_id": region_id,
+        "district_id": district_id,
+        "row_num": parse_int(data.get('rowNum'), 'rowNum'),
+        "dtp_date": dtp_date,
+        "dtp_time": dtp_time,
+        "district": data.get('District'),
+        "dtp_type": data.get('DTP_V'),
+        "deaths": parse_int(data.get('POG', 0), 'POG'),
+        "wounded": parse_int(data.get('RAN', 0), 'RAN'),
+        "vehicles_count": parse_int(data.get('K_TS', 0), 'K_TS'),
+        "participants_count": parse_int(data.get('K_UCH', 0), 'K_UCH'),
+        "emtp_number": data.get('emtp_number', ''),
+        "settlement": settlement,
+        "street": info.get('street', ''),
+        "house": info.get('house', ''),
+        "road": info.get('dor', ''),
+        "km": info.get('km', ''),
+        "m": info.get('m', ''),
+        "road_category": info.get('k_ul', ''),
+        "road_class": info.get('dor_z', ''),
+        "road_quality": info.get('s_pog', ''),
+        "weather": ', '.join(info.get('s_pog', [''])),
+        "road_condition": info.get('osv', ''),
+        "lighting": info.get('change_org_motion', ''),
+        "dtp_severity": info.get('s_dtp', ''),
+        "coord_w": parse_float(info.get('COORD_W', 0.0), 'COORD_W'),
+        "coord_l": parse_float(info.get('COORD_L', 0.0), 'COORD_L'),
+        "weather_class": weather_class(info.get('s_pog', [])),
+    }
+    if child_storage == "arrays":
+        main_row["weather"] = None
+        main_row["weather_ids"] = lookup.encode('s_pog', [describe(p) for p in info.get('s_pog', [])])
+        main_row["ndu_ids"] = lookup.encode('ndu', [describe(f) for f in info.get('ndu', [])])
+        main_row["sdor_ids"] = lookup.encode('sdor', [describe(f) for f in info.get('sdor', [])])
+        main_row["object_ids"] = lookup.encode('obj', [describe(o) for o in info.get('OBJ_DTP', [])])
+    if encode_categories:
+        lookup.encode_row("lbn.dtp_main", main_row)
+    plan.rows["lbn.dtp_main"].append(main_row)
+
+    # Обработка dtp_vehicles
+    vehicles = info.get('ts_info', [])
+    for vehicle in vehicles:
+        vehicle_num = vehicle.get('n_ts', '')
+        vehicle_row = {
+            "kart_id": kart_id,
+            "region_id": region_id,
+            "district_id": district_id,
+            "vehicle_num": vehicle_num,
+            "vehicle_status": vehicle.get('ts_s', ''),
+            "vehicle_type": vehicle.get('t_ts', ''),
+            "brand": vehicle.get('marka_ts', ''),
+            "model": vehicle.get('m_ts', ''),
+            "color": vehicle.get('color', ''),
+            "drive_type": vehicle.get('r_rul', ''),
+            "year": str(vehicle.get('g_v', '')),
+            "damage": vehicle.get('m_pov', ''),
+            "tech_condition": vehicle.get('t_n', ''),
+            "ownership": vehicle.get('f_sob', ''),
+            "owner_type": vehicle.get('o_pf', ''),
+        }
+        if encode_categories:
+            lookup.encode_row("lbn.dtp_vehicles", vehicle_row)
+        plan.rows["lbn.dtp_vehicles"].append(vehicle_row)
+
+        # Обработка dtp_participants: участники машины перезаписываются (повтор номера машины - тоже)
+        plan.participant_vehicles.append(vehicle_num)
+        plan.rows["lbn.dtp_participants"] = [
+            row for row in plan.rows["lbn.dtp_participants"] if row["vehicle_num"] != vehicle_num
+        ]
+
+        participants = vehicle.get('ts_uch', [])
+        for participant in participants:
+            violations = participant.get('NPDD', [])
+            violations_list = violations if isinstance(violations, list) else [violations]
+            participant_row = {
+                "kart_id": kart_id,
+                "region_id": region_id,
+                "district_id": district_id,
+                "vehicle_num": vehicle_num,
+                "participant_type": participant.get('K_UCH', ''),
+                "violations": violations_list,
+                "status": participant.get('S_T', ''),
+                "gender": participant.get('POL', ''),
+                "age": str(participant.get('V_ST', '')),
+                "alcohol": participant.get('ALCO', ''),
+                "safety_belt": participant.get('SAFETY_BELT', ''),
+                "participant_num": str(participant.get('N_UCH', '')),
+                "seat_group": participant.get('S_SEAT_GROUP', ''),
+                "injured_card_id": str(participant.get('INJURED_CARD_ID', '')),
+                "hidden_status": participant.get('S_SM', ''),
+            }
+            if encode_categories:
+                participant_row["violation_ids"] = lookup.encode('violations', [describe(v) for v in violations_list])
+                participant_row["violations"] = None
+                lookup.encode_row("lbn.dtp_participants", participant_row)
+            plan.rows["lbn.dtp_participants"].append(participant_row)
+
+    # Обработка dtp_factors и dtp_objects
+    if child_storage == "arrays":
+        return plan
+
+    for factor_type in ['ndu', 'sdor']:
+        factors = info.get(factor_type, [])
+        for factor in factors:
+            plan.rows["lbn.dtp_factors"].append({
+                "kart_id": kart_id,
+                "region_id": region_id,
+                "district_id": district_id,
+                "factor_type": factor_type,
+                "factor_description": describe(factor),
+            })
+
+    # Обработка dtp_objects
+    objects = info.get('OBJ_DTP', [])
+    for obj in objects:
+        plan.rows["lbn.dtp_objects"].append({
+            "kart_id": kart_id,
+            "region_id": region_id,
+            "district_id": district_id,
+            "object_description": describe(obj),
+        })
+    return plan
+
+def apply_card(cur, plan):
+    """
+    Запись одной карточки отдельными запросами (путь по одной записи под SAVEPOINT).
+    Возвращает (геохеш, дата ДТП) замененной строки lbn.dtp_main для пересчета сетки.
+    """
+    kart_id, region_id, district_id = plan.key
+    old_keys = []
+    for table, _ in CARD_TABLES:
+        if table == "lbn.dtp_main":
+            cur.execute(f"""
+                DELETE FROM {table} WHERE kart_id = %s AND region_id = %s AND district_id = %s
+                RETURNING geohash, dtp_date
+            """, (kart_id, region_id, district_id))
+            old_keys = cur.fetchall()
+        elif table == "lbn.dtp_participants":
+            for vehicle_num in plan.participant_vehicles:
+                cur.execute(f"""
+                    DELETE FROM {table}
+                    WHERE kart_id = %s AND region_id = %s AND district_id = %s AND vehicle_num = %s
+                """, (kart_id, region_id, district_id, vehicle_num))
+        else:
+            cur.execute(f"DELETE FROM {table} WHERE kart_id = %s AND region_id = %s AND district_id = %s",
+                        (kart_id, region_id, district_id))
+    for table, stamp in CARD_TABLES:
+        for row in plan.rows[table]:
+            insert_row(cur, table, row, stamp)
+    return old_keys
+
+def write_plans(cur, plans):
+    """
+    Запись карточек пакета несколькими запросами на таблицу: удаление по списку ключей
+    и вставка execute_values вместо DELETE/INSERT на каждую строку. Повтор карточки
+    в пакете заменяет предыдущий, как при записи по одной.
+    Возвращает (геохеш, дата ДТП) замененных строк lbn.dtp_main для пересчета сетки.
+    """
+    # Ключи сортируются: воркеры блокируют строки в одном порядке, что снижает риск взаимоблокировок
+    plans = sorted({plan.key: plan for plan in plans}.values(), key=lambda plan: plan.key)
+    if not plans:
+        return []
+    keys = [plan.key for plan in plans]
+    old_keys = []
+    for table, _ in CARD_TABLES:
+        if table == "lbn.dtp_main":
+            old_keys = execute_values(cur, f"""
+                DELETE FROM {table} WHERE (kart_id, region_id, district_id) IN (VALUES %s)
+                RETURNING geohash, dtp_date
+            """, keys, page_size=WRITE_PAGE_SIZE, fetch=True)
+        elif table == "lbn.dtp_participants":
+            participant_keys = [plan.key + (vehicle_num,) for plan in plans for vehicle_num in plan.participant_vehicles]
+            if participant_keys:
+                execute_values(cur, f"""
+                    DELETE FROM {table}
+                    WHERE (kart_id, region_id, district_id, vehicle_num) IN (VALUES %s)
+                """, participant_keys, page_size=WRITE_PAGE_SIZE)
+        else:
+            execute_values(cur, f"DELETE FROM {table} WHERE (kart_id, region_id, district_id) IN (VALUES %s)",
+                           keys, page_size=WRITE_PAGE_SIZE)
+
+    for table, stamp in CARD_TABLES:
+        # Набор колонок строки зависит от режима хранения; строки группируются по нему
+        groups = {}
+        for plan in plans:
+            for row in plan.rows[table]:
+                groups.setdefault(tuple(row), []).append(tuple(row.values()))
+        for columns, values in groups.items():
+            template = "(" + ", ".join(["%s"] * len(columns)) + (", CURRENT_TIMESTAMP)" if stamp else ")")
+            names = ", ".join(columns) + (", date_update" if stamp else "")
+            execute_values(cur, f"INSERT INTO {table} ({names}) VALUES %s", values,
+                           template=template, page_size=WRITE_PAGE_SIZE)
+    return old_keys
+
+def validate_cards(parsed):
+    """
+    Проверка главных строк всех карточек пакета разом (data_validation).
+    Карточки с действием dropped не пишутся; возвращает (разбор без них, записи карантина).
+    """
+    plans = [plan for _, plans in parsed for plan in plans]
+    issues = validate_dtp_rows([plan.rows["lbn.dtp_main"][0] for plan in plans])
+    records = []
+    dropped = set()
+    for index, (reasons, action, row) in issues.items():
+        plan = plans[index]
+        kart_id, region_id, district_id = plan.key
+        key = {"kart_id": kart_id, "region_id": region_id, "district_id": district_id,
+               "buffer_id": plan.buffer_id}
+        records.append((key, action, reasons, row))
+        if action == "dropped":
+            dropped.add(plan)
+    if dropped:
+        parsed = [(id, [plan for plan in plans if plan not in dropped]) for id, plans in parsed]
+    return parsed, records
+
+def write_each(cur, parsed, worker_name):
+    """
+    Запись по одной записи буфера под SAVEPOINT: ошибка откатывает только эту запись.
+    Возвращает (обработанные, с ошибками, отложенные) id и (геохеш, дата ДТП) замененных карточек.
+    """
+    processed_ids, error_ids, retry_ids, old_keys = [], [], [], []
+    for id, plans in parsed:
+        cur.execute("SAVEPOINT buffer_row")
+        try:
+            replaced = []
+            for plan in plans:
+                replaced += apply_card(cur, plan)
+            cur.execute("RELEASE SAVEPOINT buffer_row")
+            processed_ids.append(id)
+            old_keys += replaced
+
+        except psycopg2.extensions.TransactionRollbackError as e:
+            # Взаимоблокировка с другим воркером на той же карточке: запись вернется в очередь
+            logger.warning(f"[{worker_name}] Запись с id={id} отложена: {e}")
+            cur.execute("ROLLBACK TO SAVEPOINT buffer_row")
+            retry_ids.append(id)
+
+        except Exception as e:
+            logger.error(f"[{worker_name}] Ошибка обработки записи с id={id}: {e}")
+            cur.execute("ROLLBACK TO SAVEPOINT buffer_row")
+            error_ids.append(id)
+    return processed_ids, error_ids, retry_ids, old_keys
+
+def process_batch(conn, rows, worker_name, lookup=None, child_storage="rows",
+                  encode_categories=False):
+    """
+    Обрабатывает захваченный пакет одной транзакцией.
+    Сначала все карточки разбираются в памяти и проверяются (validate_cards),
+    затем пишутся пакетно (write_plans); нарушения уходят в lbn.data_quarantine,
+    а затронутые ячейки сетки очагов lbn.dtp_grid пересчитываются (dtp_grid.py).
+    Если пакетная запись упала, пакет пишется по одной записи под SAVEPOINT,
+    чтобы ошибка откатила только свою запись; отметки date_processing / is_error
+    пишутся в конце пакета разом.
+    """
+    # Счетчик ошибок разбора - только по текущему пакету: повтор после разрыва не считает их дважды
+    parse_errors.clear()
+    error_ids = []
+    decoded = []
+    for row in rows:
+        try:
+            decoded.append((row, decode_raw_json(row[3])))
+        except Exception as e:
+            logger.error(f"[{worker_name}] Ошибка разбора записи с id={row[0]}: {e}")
+            error_ids.append(row[0])
+
+    # Даты и время всех карточек пакета разбираются разом: в выгрузке за месяц они сильно повторяются
+    cards = [data for _, data_list in decoded for data in data_list if isinstance(data, dict)]
+    whens = iter(zip(parse_dates([data.get('date') for data in cards], 'date'),
+                     parse_times([data.get('Time') for data in cards], 'Time')))
+
+    parsed = []
+    for row, data_list in decoded:
+        id, region_id, district_id, raw_json, city_name = row
+        city_name = city_name if city_name else "Не указан"
+        # Разобранные значения забираются до build_card: ошибка в карточке не сдвинет их для следующих записей
+        row_whens = [next(whens) if isinstance(data, dict) else None for data in data_list]
+
+        try:
+            plans = [build_card(id, data, region_id, district_id, city_name,
+                                lookup, child_storage, encode_categories, when)
+                     for data, when in zip(data_list, row_whens)]
+        except psycopg2.Error as e:
+            # При разборе в БД ходит только словарь (LookupCache): его сбой (разрыв, переполнение кодов) -
+            # не ошибка данных. Пакет не помечается is_error и вернется в очередь после истечения захвата
+            logger.error(f"[{worker_name}] Ошибка словаря lbn.dtp_dict на записи с id={id}: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"[{worker_name}] Ошибка разбора записи с id={id}: {e}")
+            error_ids.append(id)
+            continue
+        parsed.append((id, [plan for plan in plans if plan is not None]))
+    parsed, quarantine = validate_cards(parsed)
+    main_rows = [plan.rows["lbn.dtp_main"][0] for _, plans in parsed for plan in plans]
+    assign_cells(main_rows)
+
+    cur = conn.cursor()
     try:
-        return int(value) if value is not None else 0
-    except:
-        return 0
-
-def parse_float(value):
+        cur.execute("SAVEPOINT batch_write")
+        try:
+            old_keys = write_plans(cur, [plan for _, plans in parsed for plan in plans])
+            cur.execute("RELEASE SAVEPOINT batch_write")
+            processed_ids, retry_ids = [id for id, _ in parsed], []
+        except psycopg2.Error as e:
+            if connection_lost(e, conn):
+                raise
+            logger.warning(f"[{worker_name}] Пакетная запись не удалась ({e}), запись по одной")
+            cur.execute("ROLLBACK TO SAVEPOINT batch_write")
+            processed_ids, row_error_ids, retry_ids, old_keys = write_each(cur, parsed, worker_name)
+            error_ids += row_error_ids
+        # Откатившиеся и отложенные записи не попадают в карантин: отложенная запишет его при повторе
+        processed = set(processed_ids)
+        write_quarantine(cur, "lbn.dtp_main", [record for record in quarantine if record[0]["buffer_id"] in processed])
+        # Ячейки откатившихся записей тоже пересчитываются: результат тот же, что был
+        refresh_cells(cur, old_keys + [(row["geohash"], row["dtp_date"]) for row in main_rows])
+
+        # Помечаем записи пакета
+        cur.execute("""
+            UPDATE lbn.dtp_buffer
+            SET date_processing = CASE WHEN id = ANY(%(processed)s) THEN CURRENT_TIMESTAMP END,
+                is_error = id = ANY(%(errors)s),
+                date_claim = CASE WHEN id = ANY(%(retry)s) THEN NULL ELSE date_claim END
+            WHERE id = ANY(%(all)s)
+        """, {
+            "processed": processed_ids,
+            "errors": error_ids,
+            "retry": retry_ids,
+            "all": [row[0] for row in rows],
+        })
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if not cur.closed:
+            cur.close()
+
+    logger.info(f"[{worker_name}] Пакет обработан: успешно {len(processed_ids)}, "
+                f"с ошибками {len(error_ids)}, отложено {len(retry_ids)}")
+    return len(processed_ids) + len(error_ids)
+
+def run_worker(worker_num, batch_size, child_storage="rows", encode_categories=False):
+    """
+    Захватывает и обрабатывает пакеты, пока в буфере есть свободные записи.
+    После разрыва соединения пакет повторяется на новом: незакоммиченная запись
+    откатывается, а захват истечет через CLAIM_TIMEOUT_MINUTES, если повторы кончатся.
+    """
+    worker_name = f"worker-{worker_num}"
+    pool = ReconnectingPool(1, 1)
+    lookup = LookupCache(DB_CONFIG) if child_storage == "arrays" or encode_categories else None
+    processed = 0
+    errors = Counter()
     try:
-        return float(str(value).replace(',', '.')) if value is not None else 0.0
-    except:
-        return 0.0
+        while True:
+            rows = pool.run(claim_batch, batch_size)
+            if not rows:
+                break
+
+            logger.info(f"[{worker_name}] Захвачено {len(rows)} записей для обработки")
+            processed += pool.run(process_batch, rows, worker_name, lookup, child_storage, encode_categories)
+            errors.update(parse_errors)
+    finally:
+        if lookup is not None:
+            lookup.close()
+        pool.close()
+    return processed, errors
 
 def main():
-    connection_pool = None
-    conn = None
+    args = parse_args()
+    workers = max(1, args.workers)
     try:
         logger.info("=" * 60)
-        logger.info("НАЧАЛО ОБРАБОТКИ ДТП")
-        connection_pool = pool.SimpleConnectionPool(minconn=1, maxconn=10, **DB_CONFIG)
-        if not connection_pool:
-            logger.error("Не удалось создать пул подключений!")
-            return
+        logger.info(f"НАЧАЛО ОБРАБОТКИ ДТП (воркеров: {workers})")
 
-        conn = connection_pool.getconn()
-        if not conn:
-            logger.error("Не удалось получить соединение из пула!")
-            return
+        if workers == 1:
+            results = [run_worker(1, args.batch_size, args.child_storage, args.encode_categories)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(run_worker, num, args.batch_size, args.child_storage, args.encode_categories)
+                           for num in range(1, workers + 1)]
+                results = [future.result() for future in futures]
 
-        conn.autocommit = False
-        cur = conn.cursor()
-        batch_size = 1000
-
-        while True:
-            cur.execute("""
-                SELECT id, region_id, district_id, raw_json, city_name
-                FROM lbn.dtp_buffer
-                WHERE date_processing IS NULL
-                AND is_error = FALSE
-                ORDER BY id
-                LIMIT %s
-            """, (batch_size,))
-
-            rows = cur.fetchall()
-            if not rows:
-                break
-
-            logger.info(f"Найдено {len(rows)} записей для обработки")
-
-            for row in rows:
-                id, region_id, district_id, raw_json, city_name = row
-                city_name = city_name if city_name else "Не указан"
-
-                try:
-                    if isinstance(raw_json, dict):
-                        data_list = [raw_json]
-                    else:
-                        try:
-                            data_list = json.loads(raw_json)
-                            if not isinstance(data_list, (list, dict)):
-                                logger.error(f"Некорректный формат JSON для {id}: {raw_json}")
-                                cur.execute("""
-                                    UPDATE lbn.dtp_buffer
-                                    SET is_error = TRUE
-                                    WHERE id = %s
-                                """, (id,))
-                                conn.commit()
-                                continue
-                            if isinstance(data_list, dict):
-                                data_list = [data_list]
-                        except json.JSONDecodeError:
-                            logger.error(f"Ошибка парсинга JSON для {id}: {raw_json}")
-                            cur.execute("""
-                                UPDATE lbn.dtp_buffer
-                                SET is_error = TRUE
-                                WHERE id = %s
-                            """, (id,))
-                            conn.commit()
-                            continue
-
-                    for data in data_list:
-                        if not isinstance(data, dict):
-                            logger.error(f"Некорректный формат данных для {id}: {data}")
-                            continue
-
-                        kart_id = data.get('KartId')
-                        if not kart_id:
-                            logger.warning(f"Пропуск: нет KartId для {id}")
-                            continue
-
-                        info = data.get('infoDtp', {})
-
-                        # Обработка dtp_main
-                        dtp_date = parse_date(data.get('date'))
-                        dtp_time = parse_time(data.get('Time'))
-                        settlement = info.get('n_p', city_name)
-
-                        cur.execute("DELETE FROM lbn.dtp_main WHERE kart_id = %s AND region_id = %s AND district_id = %s",
-                                    (kart_id, region_id, district_id))
-
-                        cur.execute("""
-                            INSERT INTO lbn.dtp_main (
-                                kart_id, region_id, district_id, row_num, dtp_date, dtp_time, district,
-                                dtp_type, deaths, wounded, vehicles_count, participants_count, emtp_number,
-                                settlement, street, house, road, km, m, road_category, road_class,
-                                road_quality, weather, road_condition, lighting, dtp_severity, coord_w, coord_l
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                                      %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (
-                            kart_id, region_id, district_id, parse_int(data.get('rowNum')), dtp_date, dtp_time,
-                            data.get('District'), data.get('DTP_V'), parse_int(data.get('POG', 0)),
-                            parse_int(data.get('RAN', 0)), parse_int(data.get('K_TS', 0)),
-                            parse_int(data.get('K_UCH', 0)), data.get('emtp_number', ''), settlement,
-                            info.get('street', ''), info.get('house', ''), info.get('dor', ''),
-                            info.get('km', ''), info.get('m', ''), info.get('k_ul', ''),
-                            info.get('dor_z', ''), info.get('s_pog', ''), ', '.join(info.get('s_pog', [''])),
-                            info.get('osv', ''), info.get('change_org_motion', ''),
-                            info.get('s_dtp', ''), parse_float(info.get('COORD_W', 0.0)),
-                            parse_float(info.get('COORD_L', 0.0))
-                        ))
-
-                        # Обработка dtp_vehicles
-                        cur.execute("DELETE FROM lbn.dtp_vehicles WHERE kart_id = %s AND region_id = %s AND district_id = %s",
-                                    (kart_id, region_id, district_id))
-
-                        vehicles = info.get('ts_info', [])
-                        for vehicle in vehicles:
-                            vehicle_num = vehicle.get('n_ts', '')
-                            cur.execute("""
-                                INSERT INTO lbn.dtp_vehicles (
-                                    kart_id, region_id, district_id, vehicle_num, vehicle_status, vehicle_type,
-                                    brand, model, color, drive_type, year, damage, tech_condition,
-                                    ownership, owner_type, date_update
-                                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                            """, (
-                                kart_id, region_id, district_id, vehicle_num, vehicle.get('ts_s', ''),
-                                vehicle.get('t_ts', ''), vehicle.get('marka_ts', ''),
-                                vehicle.get('m_ts', ''), vehicle.get('color', ''),
-                                vehicle.get('r_rul', ''), str(vehicle.get('g_v', '')),
-                                vehicle.get('m_pov', ''), vehicle.get('t_n', ''),
-                                vehicle.get('f_sob', ''), vehicle.get('o_pf', '')
-                            ))
-
-                            # Обработка dtp_participants
-                            cur.execute("""
-                                DELETE FROM lbn.dtp_participants
-                                WHERE kart_id = %s AND region_id = %s AND district_id = %s AND vehicle_num = %s
-                            """, (kart_id, region_id, district_id, vehicle_num))
-
-                            participants = vehicle.get('ts_uch', [])
-                            for participant in participants:
-                                violations = participant.get('NPDD', [])
-                                violations_list = violations if isinstance(violations, list) else [violations]
-                                cur.execute("""
-                                    INSERT INTO lbn.dtp_participants (
-                                        kart_id, region_id, district_id, vehicle_num, participant_type, violations,
-                                        status, gender, age, alcohol, safety_belt, participant_num, seat_group,
-                                        injured_card_id, hidden_status, date_update
-                                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                                """, (
-                                    kart_id, region_id, district_id, vehicle_num, participant.get('K_UCH', ''),
-                                    violations_list,
-                                    participant.get('S_T', ''), participant.get('POL', ''),
-                                    str(participant.get('V_ST', '')), participant.get('ALCO', ''),
-                                    participant.get('SAFETY_BELT', ''), str(participant.get('N_UCH', '')),
-                                    participant.get('S_SEAT_GROUP', ''), str(participant.get('INJURED_CARD_ID', '')),
-                                    participant.get('S_SM', '')
-                                ))
-
-                        # Обработка dtp_factors
-                        cur.execute("DELETE FROM lbn.dtp_factors WHERE kart_id = %s AND region_id = %s AND district_id = %s",
-                                    (kart_id, region_id, district_id))
-
-                        for factor_type in ['ndu', 'sdor']:
-                            factors = info.get(factor_type, [])
-                            for factor in factors:
-                                factor_description = ', '.join(factor) if isinstance(factor, list) else str(factor)
-                                cur.execute("""
-                                    INSERT INTO lbn.dtp_factors (
-                                        kart_id, region_id, district_id, factor_type, factor_description, date_update
-                                    ) VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                                """, (kart_id, region_id, district_id, factor_type, factor_description))
-
-                        # Обработка dtp_objects
-                        cur.execute("DELETE FROM lbn.dtp_objects WHERE kart_id = %s AND region_id = %s AND district_id = %s",
-                                    (kart_id, region_id, district_id))
-
-                        objects = info.get('OBJ_DTP', [])
-                        for obj in objects:
-                            obj_description = ', '.join(obj) if isinstance(obj, list) else str(obj)
-                            cur.execute("""
-                                INSERT INTO lbn.dtp_objects (
-                                    kart_id, region_id, district_id, object_description, date_update
-                                ) VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
-                            """, (kart_id, region_id, district_id, obj_description))
-
-                    # Помечаем запись как обработанную
-                    cur.execute("""
-                        UPDATE lbn.dtp_buffer
-                        SET date_processing = CURRENT_TIMESTAMP
-                        WHERE id = %s
-                    """, (id,))
-
-                    conn.commit()
-                    logger.info(f"Обработана запись с id={id}")
-
-                except Exception as e:
-                    logger.error(f"Ошибка обработки записи с id={id}: {e}")
-                    conn.rollback()
-                    cur.execute("""
-                        UPDATE lbn.dtp_buffer
-                        SET is_error = TRUE
-                        WHERE id = %s
-                    """, (id,))
-                    conn.commit()
+        total_errors = sum((errors for _, errors in results), Counter())
+        if total_errors:
+            logger.warning(f"Ошибки разбора полей (подставлено 0/NULL): {dict(total_errors)}")
 
+        logger.info(f"Обработано записей буфера: {sum(processed for processed, _ in results)}")
         logger.info("=" * 60)
         logger.info("ОБРАБОТКА ВСЕХ ЗАПИСЕЙ ЗАВЕРШЕНА")
         logger.info("=" * 60)
 
     except Exception as e:
         logger.error(f"КРИТИЧЕСКАЯ ОШИБКА: {e}")
-    finally:
-        if conn:
-            connection_pool.putconn(conn)
-        if connection_pool:
-            connection_pool.closeall()
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,6 @@
-import psycopg2
 import csv
 import re
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
+from db import connect
 
 CSV_FILE_PATH = r'C:\Users\user1\Desktop\openmeteo\_supabase_lobnya\russian_cities.csv'
 BATCH_SIZE = 1000
@@ -46,35 +42,33 @@ def process_batch(conn, batch):
 
         return len(batch)
 
-try:
-    with psycopg2.connect(
-        user=os.getenv("user"),
-        password=os.getenv("password"),
-        host=os.getenv("host"),
-        port=os.getenv("port"),
-        dbname=os.getenv("dbname")
-    ) as conn:
-        total_rows = 0
+def main():
+    try:
+        with connect() as conn:
+            total_rows = 0
+
+            with open(CSV_FILE_PATH, 'r', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                next(reader)  # Пропускаем заголовок
 
-        with open(CSV_FILE_PATH, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # Пропускаем заголовок
+                batch = []
+                for row in reader:
+                    batch.append(row)
+                    if len(batch) >= BATCH_SIZE:
+                        processed = process_batch(conn, batch)
+                        total_rows += processed
+                        print(f"Обработано: {total_rows} строк")
+                        batch = []
 
-            batch = []
-            for row in reader:
-                batch.append(row)
-                if len(batch) >= BATCH_SIZE:
+                if batch:
                     processed = process_batch(conn, batch)
                     total_rows += processed
-                    print(f"Обработано: {total_rows} строк")
-                    batch = []
+                    print(f"Обработано: {total_rows} строк (финальный пакет)")
 
-            if batch:
-                processed = process_batch(conn, batch)
-                total_rows += processed
-                print(f"Обработано: {total_rows} строк (финальный пакет)")
+            print(f"Всего загружено строк: {total_rows}")
 
-        print(f"Всего загружено строк: {total_rows}")
+    except Exception as e:
+        print(f"Ошибка: {e}")
 
-except Exception as e:
-    print(f"Ошибка: {e}")
+if __name__ == "__main__":
+    main()
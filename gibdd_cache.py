@@ -0,0 +1,76 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+# Каталог хранилища ответов stat.gibdd.ru
+CACHE_DIR = '.gibdd_cache'
+
+# Карточки текущего месяца ГИБДД еще дополняет, поэтому такой ответ живет недолго;
+# закрытые месяцы считаются неизменными и хранятся бессрочно
+CURRENT_MONTH_TTL = 6 * 3600
+
+def month_ttl(year, month, now=None):
+    """TTL ответа за месяц в секундах, None - бессрочно"""
+    now = now or datetime.now()
+    if (year, month) >= (now.year, now.month):
+        return CURRENT_MONTH_TTL
+    return None
+
+class ResponseCache:
+    """
+    Хранилище ответов API на диске с адресацией по содержимому запроса:
+    ключ - sha256 от URL и тела запроса, тело ответа хранится сжатым gzip,
+    рядом лежат метаданные (город, месяц, время загрузки) для режима replay.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def key(self, url, payload):
+        raw = json.dumps({"url": url, "payload": payload}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        directory = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(directory, f"{key}.json.gz"), os.path.join(directory, f"{key}.meta.json")
+
+    def get(self, url, payload, ttl=None):
+        """Тело ответа или None, если его нет в кэше или TTL истек"""
+        body_path, meta_path = self._paths(self.key(url, payload))
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if ttl is not None and time.time() - meta["fetched_at"] > ttl:
+                return None
+            with open(body_path, 'rb') as f:
+                return gzip.decompress(f.read())
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, url, payload, body, **meta):
+        body_path, meta_path = self._paths(self.key(url, payload))
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        meta.update({"url": url, "payload": payload, "fetched_at": time.time()})
+        # Запись через временный файл, чтобы прерванный запуск не оставил битую запись
+        for path, data in ((body_path, gzip.compress(body)),
+                           (meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def entries(self):
+        """Метаданные всех сохраненных ответов"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for directory, _, files in os.walk(self.cache_dir):
+            for name in sorted(files):
+                if name.endswith('.meta.json'):
+                    try:
+                        with open(os.path.join(directory, name), encoding='utf-8') as f:
+                            yield json.load(f)
+                    except (OSError, ValueError):
+                        continue
@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from db import connect
+
+# Каталог локальной копии: <таблица>/<раздел>=<значение>/part.parquet;
+# разделы ускоряют слияние, колонка раздела в файлах хранится как есть
+MIRROR_DIR = '.mirror'
+STATE_FILE = '_state.json'
+
+# Строк за одно чтение серверного курсора
+FETCH_CHUNK_ROWS = 50000
+
+# date_update по умолчанию - время начала транзакции: строки транзакции, начатой до прошлой
+# синхронизации и закоммиченной после нее, старше отметки. Поэтому отметка сдвигается назад
+# на время самой долгой транзакции загрузки (захват пакета dtp_processing.CLAIM_TIMEOUT_MINUTES);
+# повторно прочитанные строки снимаются слиянием по ключу
+SYNC_LAG_MINUTES = 30
+
+# Ключ карточки ДТП: dtp_processing.py удаляет и заново вставляет все строки карточки
+CARD_KEY = ["kart_id", "region_id", "district_id"]
+
+# Зеркалируемые таблицы:
+#   key - первичный ключ строк (для upsert) или None для замены карточек целиком;
+#   partition - колонка раздела (функция от DataFrame) или None;
+#   mode - upsert: строки с date_update новее отметки; cards: все строки измененных карточек
+#          lbn.dtp_main; full: таблица целиком (маленький справочник)
+TABLES = {
+    "weather": {"key": ["latitude", "longitude", "date"], "mode": "upsert",
+                "partition": ("year", lambda df: df["date"].dt.year)},
+    "dtp_main": {"key": CARD_KEY, "mode": "upsert",
+                 "partition": ("district_id", lambda df: df["district_id"])},
+    "dtp_vehicles": {"key": None, "mode": "cards",
+                     "partition": ("district_id", lambda df: df["district_id"])},
+    "dtp_participants": {"key": None, "mode": "cards",
+                         "partition": ("district_id", lambda df: df["district_id"])},
+    "dtp_factors": {"key": None, "mode": "cards",
+                    "partition": ("district_id", lambda df: df["district_id"])},
+    "dtp_objects": {"key": None, "mode": "cards",
+                    "partition": ("district_id", lambda df: df["district_id"])},
+    "dtp_dict": {"key": ["id"], "mode": "full", "partition": None},
+    # Сетка очагов: пересчитанные ячейки удаляются и вставляются заново, поэтому целиком
+    "dtp_grid": {"key": ["precision", "cell", "month", "weather_class"], "mode": "full", "partition": None},
+}
+
+def load_state(root=MIRROR_DIR):
+    try:
+        with open(os.path.join(root, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state, root=MIRROR_DIR):
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+def read_frames(conn, query, params):
+    """Результат запроса блоками DataFrame по FETCH_CHUNK_ROWS строк (серверный курсор)"""
+    import pandas as pd
+
+    with conn.cursor(name="mirror_read") as cur:
+        cur.itersize = FETCH_CHUNK_ROWS
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(FETCH_CHUNK_ROWS)
+            if not rows:
+                break
+            yield pd.DataFrame(rows, columns=[desc[0] for desc in cur.description])
+
+def partition_files(table, root=MIRROR_DIR):
+    table_dir = os.path.join(root, table)
+    if not os.path.isdir(table_dir):
+        return []
+    return sorted(os.path.join(directory, name)
+                  for directory, _, files in os.walk(table_dir) for name in files if name.endswith('.parquet'))
+
+def partition_path(table, partition_name, value, root=MIRROR_DIR):
+    if partition_name is None:
+        return os.path.join(root, table, "part.parquet")
+    return os.path.join(root, table, f"{partition_name}={value}", "part.parquet")
+
+def write_partition(path, frame):
+    """Атомарная перезапись файла раздела (через временный файл)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frame.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+def merge_partition(path, new_rows, key, replace_cards=None):
+    """
+    Слияние новых строк с файлом раздела: upsert по key (побеждает новая строка)
+    или замена всех строк карточек replace_cards.
+    """
+    import pandas as pd
+
+    if os.path.exists(path):
+        current = pd.read_parquet(path)
+        if replace_cards is not None:
+            stale = current.set_index(CARD_KEY).index.isin(replace_cards)
+            current = current[~stale]
+        frame = pd.concat([current, new_rows], ignore_index=True) if len(new_rows) else current
+    else:
+        frame = new_rows
+    if key is not None:
+        frame = frame.drop_duplicates(subset=key, keep='last')
+    write_partition(path, frame)
+    return len(frame)
+
+def apply_rows(table, config, frame, root=MIRROR_DIR):
+    """Раскладка блока строк по разделам и upsert в локальные файлы"""
+    partition = config["partition"]
+    if partition is None:
+        merge_partition(partition_path(table, None, None, root), frame, config["key"])
+        return
+    partition_name, partition_of = partition
+    for value, rows in frame.groupby(partition_of(frame)):
+        merge_partition(partition_path(table, partition_name, value, root), rows, config["key"])
+
+def sync_table(conn, table, config, watermark, root=MIRROR_DIR):
+    """
+    Дозагрузка одной таблицы. Возвращает (строк получено, новая отметка date_update).
+    Строки с date_update не старше отметки минус SYNC_LAG_MINUTES забираются повторно,
+    дубли снимаются слиянием по ключу.
+    """
+    import pandas as pd
+
+    since = (datetime.fromisoformat(watermark) - timedelta(minutes=SYNC_LAG_MINUTES)).isoformat()
+    mode = config["mode"]
+    if mode == "full":
+        frames = list(read_frames(conn, f"SELECT * FROM lbn.{table}", None))
+        if frames:
+            write_partition(partition_path(table, None, None, root), pd.concat(frames, ignore_index=True))
+        return sum(len(frame) for frame in frames), watermark
+
+    if mode == "cards":
+        # Отметка дочерней таблицы - date_update карточек lbn.dtp_main. Карточки без строк
+        # в дочерней таблице тоже попадают в список, чтобы удалить их устаревшие строки
+        card_frames = list(read_frames(conn, """
+            SELECT kart_id, region_id, district_id, date_update FROM lbn.dtp_main WHERE date_update >= %s
+        """, (since,)))
+        if not card_frames:
+            return 0, watermark
+        cards = pd.concat(card_frames, ignore_index=True)
+        row_frames = list(read_frames(conn, f"""
+            SELECT c.* FROM lbn.{table} c
+            JOIN lbn.dtp_main m USING (kart_id, region_id, district_id)
+            WHERE m.date_update >= %s
+        """, (since,)))
+        frame = pd.concat(row_frames, ignore_index=True) if row_frames else None
+
+        partition_name, partition_of = config["partition"]
+        for value, district_cards in cards.groupby(partition_of(cards)):
+            rows = frame[partition_of(frame) == value] if frame is not None else pd.DataFrame()
+            merge_partition(partition_path(table, partition_name, value, root), rows, None,
+                            pd.MultiIndex.from_frame(district_cards[CARD_KEY]))
+        return 0 if frame is None else len(frame), max(watermark, cards["date_update"].max().isoformat())
+
+    received = 0
+    for frame in read_frames(conn, f"SELECT * FROM lbn.{table} WHERE date_update >= %s ORDER BY date_update",
+                             (since,)):
+        apply_rows(table, config, frame, root=root)
+        received += len(frame)
+        watermark = max(watermark, frame["date_update"].max().isoformat())
+    return received, watermark
+
+def sync(conn, tables=None, full=False, root=MIRROR_DIR):
+    """Инкрементальная синхронизация локальной копии; full - пересобрать с нуля"""
+    tables = tables or list(TABLES)
+    state = load_state(root)
+    start = datetime(1900, 1, 1).isoformat()
+    for table in tables:
+        if full:
+            shutil.rmtree(os.path.join(root, table), ignore_errors=True)
+            state.pop(table, None)
+        received, state[table] = sync_table(conn, table, TABLES[table], state.get(table, start), root)
+        # Отметка сохраняется после каждой таблицы: прерванный запуск продолжит с нее
+        save_state(state, root)
+        print(f"{table}: получено строк {received}")
+    return state
+
+def load_table(table, columns=None, filters=None, root=MIRROR_DIR):
+    """
+    Таблица локальной копии в pandas. Файлы читаются через отображение в память,
+    filters - фильтры pyarrow по колонкам, например [("date", ">=", datetime(2020, 1, 1))].
+    """
+    import pyarrow.parquet as pq
+
+    # Каталоги разделов - только физическая раскладка, колонки берутся из самих файлов
+    return pq.read_table(os.path.join(root, table), columns=columns, filters=filters,
+                         memory_map=True, partitioning=None).to_pandas()
+
+def connect_duckdb(root=MIRROR_DIR):
+    """
+    Соединение DuckDB с представлениями lbn.<таблица> поверх Parquet-файлов:
+    запросы, написанные для Supabase, выполняются локально без изменений.
+    """
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute("CREATE SCHEMA IF NOT EXISTS lbn")
+    for table in TABLES:
+        if partition_files(table, root):
+            pattern = os.path.join(root, table, "**", "*.parquet").replace("'", "''")
+            con.execute(f"CREATE VIEW lbn.{table} AS "
+                        f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = false, union_by_name = true)")
+    return con
+
+def query(sql, root=MIRROR_DIR):
+    """SQL по локальной копии (DuckDB), результат - DataFrame"""
+    con = connect_duckdb(root)
+    try:
+        return con.execute(sql).df()
+    finally:
+        con.close()
+
+def stats(root=MIRROR_DIR):
+    state = load_state(root)
+    for table in TABLES:
+        files = partition_files(table, root)
+        size = sum(os.path.getsize(path) for path in files)
+        print(f"{table:<18} разделов {len(files):>4}, {size / 1024 / 1024:>7.1f} МБ, "
+              f"отметка {state.get(table, '-')}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная Parquet-копия таблиц lbn для аналитики.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Дозагрузить изменения из БД")
+    sync_parser.add_argument("--tables", nargs="+", choices=list(TABLES), help="Только эти таблицы")
+    sync_parser.add_argument("--full", action="store_true", help="Пересобрать копию с нуля")
+    query_parser = subparsers.add_parser("query", help="Выполнить SQL по локальной копии (DuckDB)")
+    query_parser.add_argument("sql", help='Запрос, например "SELECT COUNT(*) FROM lbn.dtp_main"')
+    subparsers.add_parser("stats", help="Размер копии и отметки синхронизации")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        with connect() as conn:
+            sync(conn, args.tables, args.full)
+        stats()
+    elif args.command == "query":
+        print(query(args.sql).to_string())
+    else:
+        stats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import csv
+import json
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+REGIONS_CSV = 'regions_coord.csv'
+EARTH_RADIUS_KM = 6371.0
+
+# Полигоны в CSV упрощены: точка у границы (побережье, край района) может оказаться
+# снаружи, поэтому точки ближе этого расстояния до границы считаются внутри
+BORDER_TOLERANCE_KM = 5.0
+
+# Ограничение размера матрицы точки x ребра при проверке (число элементов)
+BLOCK_ELEMENTS = 2_000_000
+
+# Коды регионов ОКАТО (region_id в данных ГИБДД) -> регионы regions_coord.csv.
+# Автономные округа входят в код своей области
+OKATO_REGIONS = {
+    "01": ["Алтайский край"],
+    "03": ["Краснодарский край"],
+    "04": ["Красноярский край"],
+    "05": ["Приморский край"],
+    "07": ["Ставропольский край"],
+    "08": ["Хабаровский край"],
+    "10": ["Амурская область"],
+    "11": ["Архангельская область", "Ненецкий автономный округ"],
+    "12": ["Астраханская область"],
+    "14": ["Белгородская область"],
+    "15": ["Брянская область"],
+    "17": ["Владимирская область"],
+    "18": ["Волгоградская область"],
+    "19": ["Вологодская область"],
+    "20": ["Воронежская область"],
+    "22": ["Нижегородская область"],
+    "24": ["Ивановская область"],
+    "25": ["Иркутская область"],
+    "26": ["республика Ингушетия"],
+    "27": ["Калининградская область"],
+    "28": ["Тверская область"],
+    "29": ["Калужская область"],
+    "30": ["Камчатский край"],
+    "32": ["Кемеровская область"],
+    "33": ["Кировская область"],
+    "34": ["Костромская область"],
+    "35": ["республика Крым"],
+    "36": ["Самарская область"],
+    "37": ["Курганская область"],
+    "38": ["Курская область"],
+    "40": ["Санкт-Петербург"],
+    "41": ["Ленинградская область"],
+    "42": ["Липецкая область"],
+    "44": ["Магаданская область"],
+    "45": ["Москва"],
+    "46": ["Московская область"],
+    "47": ["Мурманская область"],
+    "49": ["Новгородская область"],
+    "50": ["Новосибирская область"],
+    "52": ["Омская область"],
+    "53": ["Оренбургская область"],
+    "54": ["Орловская область"],
+    "56": ["Пензенская область"],
+    "57": ["Пермский край"],
+    "58": ["Псковская область"],
+    "60": ["Ростовская область"],
+    "61": ["Рязанская область"],
+    "63": ["Саратовская область"],
+    "64": ["Сахалинская область"],
+    "65": ["Свердловская область"],
+    "66": ["Смоленская область"],
+    "67": ["Севастополь"],
+    "68": ["Тамбовская область"],
+    "69": ["Томская область"],
+    "70": ["Тульская область"],
+    "71": ["Тюменская область", "Ханты-Мансийский (Югра) автономный округ", "Ямало-Ненецкий автономный округ"],
+    "73": ["Ульяновская область"],
+    "75": ["Челябинская область"],
+    "76": ["Забайкальский край"],
+    "77": ["Чукотский автономный округ"],
+    "78": ["Ярославская область"],
+    "79": ["республика Адыгея"],
+    "80": ["республика Башкортостан"],
+    "81": ["республика Бурятия"],
+    "82": ["республика Дагестан"],
+    "83": ["республика Кабардино-Балкария"],
+    "84": ["республика Алтай"],
+    "85": ["республика Калмыкия"],
+    "86": ["республика Карелия"],
+    "87": ["республика Коми"],
+    "88": ["республика Марий Эл"],
+    "89": ["республика Мордовия"],
+    "90": ["республика Северная Осетия - Алания"],
+    "91": ["республика Карачаево-Черкесия"],
+    "92": ["республика Татарстан"],
+    "93": ["республика Тыва"],
+    "94": ["республика Удмуртия"],
+    "95": ["республика Хакасия"],
+    "96": ["республика Чечня"],
+    "97": ["республика Чувашия"],
+    "98": ["республика Саха (Якутия)"],
+    "99": ["Еврейская автономная область"],
+}
+
+class RegionPolygons:
+    """
+    Границы регионов для векторной проверки "точка в полигоне".
+    Кольца региона хранятся массивами ребер; принадлежность считается по правилу
+    чет-нечет по всем кольцам (анклавы и острова без отдельной разметки дыр).
+    Долгота приводится к [0, 360), чтобы Чукотка не разрывалась на 180-м меридиане.
+    """
+
+    def __init__(self, names, polygons):
+        self.names = list(names)
+        self.edges = []
+        self.bounds = np.empty((len(self.names), 4))
+        for i, rings in enumerate(polygons):
+            starts, ends = [], []
+            for ring in rings:
+                ring = np.asarray(ring, dtype=np.float64)
+                ring[:, 1] %= 360
+                starts.append(ring)
+                ends.append(np.roll(ring, -1, axis=0))
+            start, end = np.concatenate(starts), np.concatenate(ends)
+            self.edges.append((start[:, 0], start[:, 1], end[:, 0], end[:, 1]))
+            self.bounds[i] = (start[:, 0].min(), start[:, 0].max(), start[:, 1].min(), start[:, 1].max())
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_csv(cls, path=REGIONS_CSV):
+        # Поле coords - JSON с кольцами [[[широта, долгота], ...], ...], строки очень длинные
+        csv.field_size_limit(sys.maxsize)
+        names, polygons = [], []
+        with open(path, encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                names.append(row["region"])
+                polygons.append(json.loads(row["coords"]))
+        return cls(names, polygons)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, region, latitude, longitude, tolerance_km):
+        """Маска точек внутри прямоугольника региона, расширенного на допуск"""
+        lat_min, lat_max, lon_min, lon_max = self.bounds[region]
+        lat_pad = np.degrees(tolerance_km / EARTH_RADIUS_KM)
+        lon_pad = lat_pad / max(np.cos(np.radians(max(abs(lat_min), abs(lat_max)))), 0.01)
+        return ((latitude >= lat_min - lat_pad) & (latitude <= lat_max + lat_pad)
+                & (longitude >= lon_min - lon_pad) & (longitude <= lon_max + lon_pad))
+
+    def _inside(self, region, latitude, longitude, tolerance_km):
+        """Точки (уже отобранные по прямоугольнику) внутри региона или ближе допуска к границе"""
+        lat1, lon1, lat2, lon2 = self.edges[region]
+        result = np.zeros(len(latitude), dtype=bool)
+        block = max(1, BLOCK_ELEMENTS // len(lat1))
+        for offset in range(0, len(latitude), block):
+            lat = latitude[offset:offset + block, None]
+            lon = longitude[offset:offset + block, None]
+            # Луч вдоль параллели на восток: ребро пересекается, если его концы по разные стороны точки.
+            # Точки пакета обычно из одного города, поэтому сначала отбрасываются ребра вне их полосы широт
+            band = (np.maximum(lat1, lat2) >= lat.min()) & (np.minimum(lat1, lat2) <= lat.max())
+            b_lat1, b_lon1, b_lat2, b_lon2 = lat1[band], lon1[band], lat2[band], lon2[band]
+            straddles = (b_lat1 > lat) != (b_lat2 > lat)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crossing = b_lon1 + (lat - b_lat1) * (b_lon2 - b_lon1) / (b_lat2 - b_lat1)
+            inside = np.count_nonzero(straddles & (lon < crossing), axis=1) % 2 == 1
+
+            outside = np.flatnonzero(~inside)
+            if tolerance_km > 0 and len(outside):
+                # Расстояние до ближайшего ребра в локальной равнопромежуточной проекции
+                lat, lon = lat[outside], lon[outside]
+                scale = np.cos(np.radians(lat))
+                dx, dy = (lon2 - lon1) * scale, lat2 - lat1
+                px, py = (lon - lon1) * scale, lat - lat1
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    t = np.clip(np.nan_to_num((px * dx + py * dy) / (dx * dx + dy * dy)), 0, 1)
+                distance = np.radians(np.sqrt(((px - t * dx) ** 2 + (py - t * dy) ** 2).min(axis=1)))
+                inside[outside] = distance * EARTH_RADIUS_KM <= tolerance_km
+            result[offset:offset + block] = inside
+        return result
+
+    def contains(self, names, latitude, longitude, tolerance_km=BORDER_TOLERANCE_KM):
+        """Маска точек внутри любого из регионов names"""
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64) % 360
+        result = np.zeros(len(latitude), dtype=bool)
+        for name in names:
+            region = self.index[name]
+            candidates = np.flatnonzero(self._candidates(region, latitude, longitude, tolerance_km) & ~result)
+            if len(candidates):
+                result[candidates] = self._inside(region, latitude[candidates], longitude[candidates], tolerance_km)
+        return result
+
+    def locate(self, latitude, longitude, tolerance_km=0.0):
+        """Номер региона для каждой точки (-1 - вне всех регионов); при допуске берется первый подходящий"""
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64) % 360
+        result = np.full(len(latitude), -1, dtype=np.int64)
+        for region in range(len(self.names)):
+            candidates = np.flatnonzero(self._candidates(region, latitude, longitude, tolerance_km) & (result < 0))
+            if len(candidates):
+                inside = self._inside(region, latitude[candidates], longitude[candidates], tolerance_km)
+                result[candidates[inside]] = region
+        return result
+
+@lru_cache(maxsize=None)
+def load_region_polygons(path=REGIONS_CSV):
+    """Границы регионов из CSV, строятся при первом обращении и кэшируются"""
+    return RegionPolygons.from_csv(path)
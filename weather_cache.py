@@ -0,0 +1,144 @@
+import argparse
+import os
+import sqlite3
+import time
+import zlib
+from collections import Counter
+from urllib.parse import urlparse
+
+import requests_cache
+from requests_cache import NEVER_EXPIRE, SerializerPipeline, Stage, pickle_serializer
+
+# Общий кэш ответов Open-Meteo (файл .cache.sqlite)
+CACHE_NAME = '.cache'
+CACHE_PATH = CACHE_NAME + '.sqlite'
+
+# Предел размера кэша: при превышении удаляются давно не использованные ответы
+MAX_CACHE_MB = 200
+
+# TTL по эндпоинтам: архив за прошедшие даты не меняется, прогноз обновляется каждый час
+URLS_EXPIRE_AFTER = {
+    'archive-api.open-meteo.com': NEVER_EXPIRE,
+    'api.open-meteo.com': 3600,
+}
+DEFAULT_EXPIRE_AFTER = 3600
+
+# Тела ответов (FlatBuffers) хранятся сжатыми zlib
+compressed_serializer = SerializerPipeline(
+    [pickle_serializer, Stage(dumps=zlib.compress, loads=zlib.decompress)],
+    name='pickle_zlib',
+    is_binary=True,
+)
+
+class TrackedSession(requests_cache.CachedSession):
+    """
+    CachedSession, которая считает попадания в кэш за запуск и пишет время
+    последнего обращения к каждому ответу в таблицу access_log (для LRU).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hits = 0
+        self.misses = 0
+        self.access_conn = sqlite3.connect(self.cache.responses.db_path, isolation_level=None)
+        self.access_conn.execute("CREATE TABLE IF NOT EXISTS access_log (key TEXT PRIMARY KEY, last_access REAL)")
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if getattr(response, 'from_cache', False):
+            self.hits += 1
+        else:
+            self.misses += 1
+        key = getattr(response, 'cache_key', None)
+        if key:
+            self.access_conn.execute("""
+                INSERT INTO access_log (key, last_access) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET last_access = excluded.last_access
+            """, (key, time.time()))
+        return response
+
+    def hit_rate_summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"Кэш Open-Meteo: попаданий {self.hits} из {total} ({rate:.0f}%)"
+
+    def close(self):
+        self.access_conn.close()
+        super().close()
+
+def make_session(cache_name=CACHE_NAME):
+    return TrackedSession(
+        cache_name,
+        serializer=compressed_serializer,
+        expire_after=DEFAULT_EXPIRE_AFTER,
+        urls_expire_after=URLS_EXPIRE_AFTER,
+    )
+
+def evict(session, max_mb=MAX_CACHE_MB):
+    """
+    Удаляет просроченные ответы, затем самые давно использованные, пока суммарный
+    размер ответов не станет меньше max_mb. Возвращает число удаленных LRU-записей.
+    """
+    session.cache.delete(expired=True)
+
+    conn = session.access_conn
+    max_bytes = max_mb * 1024 * 1024
+    total = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    # Ответы без отметки обращения (записаны до появления access_log) считаются самыми старыми
+    stale_keys = []
+    for key, size in conn.execute("""
+        SELECT r.key, LENGTH(r.value)
+        FROM responses r
+        LEFT JOIN access_log a ON a.key = r.key
+        ORDER BY COALESCE(a.last_access, 0)
+    """).fetchall():
+        if total <= max_bytes:
+            break
+        stale_keys.append(key)
+        total -= size
+
+    session.cache.delete(*stale_keys)
+    conn.execute("DELETE FROM access_log WHERE key NOT IN (SELECT key FROM responses)")
+    return len(stale_keys)
+
+def finish_session(session, max_mb=MAX_CACHE_MB):
+    """Завершение запуска: ограничение размера кэша и строка со статистикой попаданий"""
+    evicted = evict(session, max_mb)
+    summary = session.hit_rate_summary()
+    if evicted:
+        summary += f", вытеснено {evicted} старых ответов"
+    session.close()
+    return summary
+
+def stats(session):
+    conn = session.access_conn
+    count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM responses").fetchone()
+    expired = conn.execute("SELECT COUNT(*) FROM responses WHERE expires IS NOT NULL AND expires <= ?",
+                           (time.time(),)).fetchone()[0]
+    hosts = Counter(urlparse(response.url).netloc for response in session.cache.responses.values())
+
+    print(f"Файл кэша: {CACHE_PATH}, {os.path.getsize(CACHE_PATH) / 1024 / 1024:.1f} МБ")
+    print(f"Ответов: {count}, просрочено: {expired}, данные: {size / 1024 / 1024:.1f} МБ")
+    for host, host_count in hosts.most_common():
+        print(f"  {host}: {host_count}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание кэша ответов Open-Meteo.")
+    parser.add_argument("command", choices=["stats", "vacuum"],
+                        help="stats - статистика; vacuum - вытеснение по размеру и сжатие файла")
+    parser.add_argument("--max_mb", type=int, default=MAX_CACHE_MB, help="Предел размера кэша в МБ")
+    args = parser.parse_args()
+
+    session = make_session()
+    if args.command == "vacuum":
+        evicted = evict(session, args.max_mb)
+        session.cache.responses.vacuum()
+        print(f"Вытеснено ответов: {evicted}")
+    stats(session)
+    session.close()
+
+if __name__ == "__main__":
+    main()
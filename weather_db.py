@@ -0,0 +1,172 @@
+# Почасовые переменные Open-Meteo в порядке колонок lbn.weather_BUFFER
+HOURLY_VARIABLES = ["temperature_2m", "wind_speed_10m", "wind_direction_10m", "apparent_temperature",
+                    "precipitation", "rain", "showers", "snowfall", "snow_depth", "is_day", "sunshine_duration"]
+
+# Перенос из lbn.weather_BUFFER в lbn.weather
+UPSERT_SQL = """
+    INSERT INTO lbn.weather
+    SELECT date,
+        temperature_2m,
+        wind_speed_10m,
+        wind_direction_10m,
+        apparent_temperature,
+        precipitation,
+        rain,
+        showers,
+        snowfall,
+        snow_depth,
+        CASE WHEN is_day = 1 THEN TRUE ELSE FALSE END,
+        sunshine_duration,
+        latitude,
+        longitude,
+        CURRENT_TIMESTAMP
+    FROM lbn.weather_BUFFER
+    ON CONFLICT (latitude, longitude, date) DO UPDATE SET
+        temperature_2m = EXCLUDED.temperature_2m,
+        wind_speed_10m = EXCLUDED.wind_speed_10m,
+        wind_direction_10m = EXCLUDED.wind_direction_10m,
+        apparent_temperature = EXCLUDED.apparent_temperature,
+        precipitation = EXCLUDED.precipitation,
+        rain = EXCLUDED.rain,
+        showers = EXCLUDED.showers,
+        snowfall = EXCLUDED.snowfall,
+        snow_depth = EXCLUDED.snow_depth,
+        is_day = EXCLUDED.is_day,
+        sunshine_duration = EXCLUDED.sunshine_duration,
+        date_update = CURRENT_TIMESTAMP
+"""
+
+# Строк в одном блоке колонок при потоковой загрузке через COPY
+COPY_CHUNK_ROWS = 2000
+
+# Координаты городов, для которых ведется погода
+CITIES = [
+    {"latitude": 56.0104473, "longitude": 37.4670831},
+    {"latitude": 54.710128, "longitude": 20.5105838},
+    # Добавьте другие города по необходимости
+]
+
+def validate_rows(batch):
+    """
+    Проверка строк пакета (порядок колонок lbn.weather_BUFFER) по data_validation.WEATHER_RULES.
+    Возвращает (строки с NULL вместо ошибочных значений, записи карантина).
+    """
+    from data_validation import as_float_array, validate_weather_columns
+
+    columns = {name: as_float_array([row[i + 1] for row in batch]) for i, name in enumerate(HOURLY_VARIABLES)}
+    columns, issues = validate_weather_columns(columns)
+    if not issues:
+        return batch, []
+    batch = list(batch)
+    records = []
+    for index, (reasons, action) in issues.items():
+        row = batch[index]
+        key = {"latitude": row[-2], "longitude": row[-1], "date": row[0]}
+        records.append((key, action, reasons, dict(zip(["date"] + HOURLY_VARIABLES, row))))
+        values = [None if columns[name][index] != columns[name][index] else row[i + 1]
+                  for i, name in enumerate(HOURLY_VARIABLES)]
+        batch[index] = (row[0], *values, *row[-2:])
+    return batch, records
+
+def process_batch(conn, batch, is_first_batch=True):
+    """
+    Загрузка пакета строк через lbn.weather_BUFFER с upsert в lbn.weather.
+    Строки проверяются до отправки (validate_rows), нарушения пишутся в lbn.data_quarantine.
+    Очистка буфера, вставка и upsert уходят одним запросом (один обмен с сервером на пакет).
+    Транзакцию фиксирует вызывающий код (по пакету или по городу).
+    """
+    from data_validation import write_quarantine
+
+    batch, quarantine = validate_rows(batch)
+    with conn.cursor() as cursor:
+        args_str = ','.join(cursor.mogrify("(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", x).decode('utf-8') for x in batch)
+        truncate = "TRUNCATE TABLE lbn.weather_BUFFER;" if is_first_batch else ""
+        cursor.execute(f"{truncate}\nINSERT INTO lbn.weather_BUFFER VALUES {args_str};\n{UPSERT_SQL}")
+        write_quarantine(cursor, "lbn.weather", quarantine)
+        return len(batch)
+
+def iter_chunks(response, chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Нарезает почасовой ответ Open-Meteo на блоки фиксированного размера:
+    (время в секундах UTC, срезы массивов переменных без копирования).
+    """
+    # numpy импортируется при первом использовании, чтобы импорт weather_db оставался быстрым
+    import numpy as np
+
+    hourly = response.Hourly()
+    start, interval = hourly.Time(), hourly.Interval()
+    count = (hourly.TimeEnd() - start) // interval
+    variables = [hourly.Variables(i).ValuesAsNumpy() for i in range(len(HOURLY_VARIABLES))]
+    for offset in range(0, count, chunk_rows):
+        stop = min(offset + chunk_rows, count)
+        times = start + np.arange(offset, stop, dtype=np.int64) * interval
+        yield times, [values[offset:stop] for values in variables]
+
+def chunk_to_copy_text(times, columns, latitude, longitude):
+    """Блок колонок -> строки COPY в текстовом формате (NaN -> \\N), время в UTC"""
+    import numpy as np
+
+    fields = [np.datetime_as_string(times.astype('datetime64[s]'), unit='s').tolist()]
+    for values in columns:
+        # '.9g' - кратчайшая запись, которая гарантированно восстанавливает float32
+        fields.append(['\\N' if x != x else format(x, '.9g') for x in values.tolist()])
+    suffix = f"\t{latitude}\t{longitude}\n"
+    return suffix.join(map('\t'.join, zip(*fields))) + suffix
+
+class ChunkStream:
+    """Файлоподобный объект для COPY: текст из генератора блоков читается по мере отправки"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def copy_chunks(response, city, chunk_rows=COPY_CHUNK_ROWS, quarantine=None):
+    """
+    Генератор текстовых блоков COPY для ответа одного города.
+    Блоки проверяются по data_validation.WEATHER_RULES; если передан список quarantine,
+    в него добавляются записи о нарушениях.
+    """
+    import numpy as np
+    from data_validation import validate_weather_columns
+
+    for times, columns in iter_chunks(response, chunk_rows):
+        checked, issues = validate_weather_columns(dict(zip(HOURLY_VARIABLES, columns)))
+        if issues and quarantine is not None:
+            for index, (reasons, action) in issues.items():
+                moment = str(np.datetime64(int(times[index]), 's'))
+                key = {"latitude": city["latitude"], "longitude": city["longitude"], "date": moment}
+                # Пропуски (NaN) в исходной строке - NULL в JSON
+                payload = {name: None if values[index] != values[index] else values[index].item()
+                           for name, values in zip(HOURLY_VARIABLES, columns)}
+                quarantine.append((key, action, reasons, payload))
+        columns = [checked[name] for name in HOURLY_VARIABLES]
+        yield chunk_to_copy_text(times, columns, city["latitude"], city["longitude"])
+
+def load_response(conn, response, city):
+    """
+    Потоковая загрузка ответа: блоки колонок -> COPY в lbn.weather_BUFFER -> upsert.
+    Пиковая память определяется размером блока, а не числом строк.
+    """
+    from data_validation import write_quarantine
+
+    quarantine = []
+    stream = ChunkStream(copy_chunks(response, city, quarantine=quarantine))
+    with conn.cursor() as cursor:
+        cursor.execute("TRUNCATE TABLE lbn.weather_BUFFER")
+        cursor.copy_expert("COPY lbn.weather_BUFFER FROM STDIN", stream)
+        rows = cursor.rowcount
+        cursor.execute(UPSERT_SQL)
+        write_quarantine(cursor, "lbn.weather", quarantine)
+    conn.commit()
+    return rows
@@ -0,0 +1,316 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from db import connect
+
+# Часовой пояс времени в карточках ДТП по региону ОКАТО (region_id); остальные регионы - московское время
+REGION_TIMEZONES = {
+    "27": "Europe/Kaliningrad",
+}
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+# Точка погоды дальше этого расстояния от города не считается его погодой
+MAX_WEATHER_DISTANCE_KM = 30
+
+# Границы интервалов погодных переменных: (переменная, границы, подписи интервалов)
+BINS = [
+    ("precipitation", [0.1, 1.0, 5.0], ["нет", "0.1-1 мм", "1-5 мм", ">5 мм"]),
+    ("snowfall", [0.01, 0.5], ["нет", "до 0.5 см", ">0.5 см"]),
+    ("temperature_2m", [-15, -5, 0, 5, 15, 25],
+     ["<-15", "-15..-5", "-5..0", "0..5", "5..15", "15..25", ">25"]),
+    ("is_day", [0.5], ["ночь", "день"]),
+]
+WEATHER_VARIABLES = [variable for variable, _, _ in BINS]
+
+# Open-Meteo отдает погоду с шагом 3 часа. Мгновенное значение действует на 3 часа вперед,
+# а суммы (осадки, снег, солнце) накоплены за 3 часа до метки и относятся к ним
+WEATHER_STEP_HOURS = 3
+ACCUMULATED_VARIABLES = {"precipitation", "rain", "showers", "snowfall", "sunshine_duration"}
+
+CACHE_DIR = '.analytics_cache'
+# Строк за одно чтение серверного курсора
+FETCH_CHUNK_ROWS = 50000
+BOOTSTRAP_SAMPLES = 2000
+CONFIDENCE = 0.95
+
+def load_cities():
+    """
+    Города ДТП (dtp_download.CITIES) с ближайшей точкой погоды (weather_db.CITIES).
+    Координаты города берутся из russian_cities.csv по названию (и региону при совпадении названий).
+    """
+    from city_index import load_city_index, load_weather_index
+    from dtp_download import CITIES as DTP_CITIES
+    from region_polygons import OKATO_REGIONS
+
+    index = load_city_index()
+    weather_index = load_weather_index()
+    cities = []
+    for dtp_city in DTP_CITIES:
+        found = np.flatnonzero(index.names == dtp_city["name"])
+        in_region = [i for i in found if index.regions[i] in OKATO_REGIONS.get(dtp_city["region_id"], [])]
+        if in_region:
+            found = in_region
+        if not len(found):
+            print(f"{dtp_city['name']}: нет координат города в справочнике, пропуск")
+            continue
+        point, distance = weather_index.nearest([index.latitude[found[0]]], [index.longitude[found[0]]])
+        if not distance[0] <= MAX_WEATHER_DISTANCE_KM:
+            print(f"{dtp_city['name']}: нет точки погоды ближе {MAX_WEATHER_DISTANCE_KM} км, пропуск")
+            continue
+        cities.append({
+            "name": dtp_city["name"],
+            "district_id": dtp_city["district_id"],
+            "latitude": float(weather_index.latitude[point[0]]),
+            "longitude": float(weather_index.longitude[point[0]]),
+            "timezone": REGION_TIMEZONES.get(dtp_city["region_id"], DEFAULT_TIMEZONE),
+        })
+    return cities
+
+def cache_path(kind, city, since):
+    key = hashlib.sha256(json.dumps([kind, city["district_id"], city["latitude"], city["longitude"],
+                                     since.isoformat()]).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{kind}_{key}.npz")
+
+def read_chunked(conn, query, params, convert):
+    """
+    Чтение большого результата серверным курсором блоками по FETCH_CHUNK_ROWS строк.
+    convert(rows) -> словарь массивов блока; блоки склеиваются в конце.
+    """
+    parts = []
+    with conn.cursor(name="analytics_read") as cur:
+        cur.itersize = FETCH_CHUNK_ROWS
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(FETCH_CHUNK_ROWS)
+            if not rows:
+                break
+            parts.append(convert(rows))
+    if not parts:
+        return None
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def cached_read(conn, kind, city, since, version_query, version_params, query, params, convert, use_cache=True):
+    """
+    Массивы из БД с локальным кэшем .npz. Кэш действителен, пока не изменились
+    число строк и максимальная date_update источника (один дешевый запрос).
+    """
+    with conn.cursor() as cur:
+        cur.execute(version_query, version_params)
+        version = str(cur.fetchone())
+
+    path = cache_path(kind, city, since)
+    if use_cache and os.path.exists(path):
+        with np.load(path, allow_pickle=False) as cached:
+            if str(cached["version"]) == version:
+                return {name: cached[name] for name in cached.files if name != "version"}
+
+    arrays = read_chunked(conn, query, params, convert)
+    if arrays is None:
+        return None
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    np.savez(path, version=np.array(version), **arrays)
+    return arrays
+
+def weather_rows_to_arrays(rows):
+    columns = list(zip(*rows))
+    arrays = {"hour": np.array(columns[0], dtype='datetime64[h]').astype(np.int64)}
+    for i, variable in enumerate(WEATHER_VARIABLES, start=1):
+        arrays[variable] = np.array(columns[i], dtype=np.float64)
+    return arrays
+
+def load_weather(conn, city, since, use_cache=True):
+    """Погода города: час (с эпохи, UTC) и переменные WEATHER_VARIABLES"""
+    where = "WHERE latitude = %s AND longitude = %s AND date >= %s"
+    params = (city["latitude"], city["longitude"], since)
+    # CASE: is_day хранится boolean, в массив идет 0/1
+    columns = ", ".join("CASE WHEN is_day THEN 1.0 ELSE 0.0 END" if variable == "is_day" else variable
+                        for variable in WEATHER_VARIABLES)
+    return cached_read(
+        conn, "weather", city, since,
+        f"SELECT COUNT(*), MAX(date_update) FROM lbn.weather {where}", params,
+        f"SELECT date, {columns} FROM lbn.weather {where} ORDER BY date", params,
+        weather_rows_to_arrays, use_cache
+    )
+
+def dtp_rows_to_arrays(rows):
+    dates, times = zip(*rows)
+    day = np.array(dates, dtype='datetime64[D]')
+    seconds = np.array([t.hour * 3600 + t.minute * 60 if t is not None else -1 for t in times], dtype=np.int64)
+    return {"day": day.astype(np.int64), "seconds": seconds}
+
+def load_dtp(conn, city, since, use_cache=True):
+    """Дата и время (секунды от полуночи, -1 - не указано) ДТП города по местному времени"""
+    where = "WHERE district_id = %s AND dtp_date >= %s"
+    params = (city["district_id"], since)
+    return cached_read(
+        conn, "dtp", city, since,
+        f"SELECT COUNT(*), MAX(date_update) FROM lbn.dtp_main {where}", params,
+        f"SELECT dtp_date, dtp_time FROM lbn.dtp_main {where} ORDER BY dtp_date", params,
+        dtp_rows_to_arrays, use_cache
+    )
+
+def local_to_utc_hours(day, seconds, timezone):
+    """Местные дата и время карточек -> час с эпохи в UTC (с учетом перехода Москвы с UTC+4 в 2014)"""
+    import pandas as pd
+
+    local = pd.to_datetime(day, unit='D') + pd.to_timedelta(seconds, unit='s')
+    utc = local.tz_localize(timezone, ambiguous='NaT', nonexistent='NaT').tz_convert('UTC').tz_localize(None)
+    hours = utc.values.astype('datetime64[h]').astype(np.int64)
+    return hours[~utc.isna()]
+
+def align_city(weather, dtp, timezone):
+    """
+    Выравнивание на общую почасовую сетку: счетчик ДТП за каждый час
+    и значения погоды (3-часовое значение распространяется на свои 3 часа:
+    мгновенное - на метку и 2 часа после, сумма - на 2 часа до метки и саму метку).
+    """
+    known_time = dtp["seconds"] >= 0
+    dtp_hours = local_to_utc_hours(dtp["day"][known_time], dtp["seconds"][known_time], timezone)
+    no_time = int(np.count_nonzero(~known_time))
+    if len(dtp_hours) == 0:
+        return np.zeros(0, dtype=np.int64), {variable: np.zeros(0) for variable in WEATHER_VARIABLES}, no_time
+
+    start = max(weather["hour"].min(), dtp_hours.min())
+    end = min(weather["hour"].max() + WEATHER_STEP_HOURS, dtp_hours.max() + 1)
+    size = int(end - start)
+
+    in_range = (dtp_hours >= start) & (dtp_hours < end)
+    counts = np.bincount(dtp_hours[in_range] - start, minlength=size)
+
+    grid = {}
+    positions = weather["hour"] - start
+    for variable in WEATHER_VARIABLES:
+        values = np.full(size, np.nan)
+        offsets = range(1 - WEATHER_STEP_HOURS, 1) if variable in ACCUMULATED_VARIABLES else range(WEATHER_STEP_HOURS)
+        for offset in offsets:
+            target = positions + offset
+            valid = (target >= 0) & (target < size)
+            values[target[valid]] = weather[variable][valid]
+        grid[variable] = values
+    return counts, grid, no_time
+
+def bootstrap_mean_ci(counts, samples, rng, confidence=CONFIDENCE):
+    """
+    Доверительный интервал среднего числа ДТП в час бутстрепом.
+    Выборка с возвращением из n часов эквивалентна мультиномиальному
+    распределению по различным значениям счетчика, поэтому все выборки
+    считаются одним векторным вызовом без матрицы индексов n x samples.
+    """
+    values, frequency = np.unique(counts, return_counts=True)
+    n = len(counts)
+    draws = rng.multinomial(n, frequency / n, size=samples)
+    means = draws @ values / n
+    alpha = (1 - confidence) / 2
+    return np.quantile(means, [alpha, 1 - alpha])
+
+def summarize_city(counts, grid, samples, rng):
+    """Строки сводки: частота ДТП на 1000 часов по интервалам каждой переменной"""
+    has_weather = ~np.isnan(grid[WEATHER_VARIABLES[0]])
+    overall_rate = counts[has_weather].mean() if has_weather.any() else np.nan
+    rows = []
+    for variable, edges, labels in BINS:
+        values = grid[variable]
+        known = ~np.isnan(values)
+        bins = np.digitize(values[known], edges)
+        known_counts = counts[known]
+        for bin_order, label in enumerate(labels):
+            bin_counts = known_counts[bins == bin_order]
+            if len(bin_counts) == 0:
+                continue
+            rate = bin_counts.mean()
+            ci_low, ci_high = bootstrap_mean_ci(bin_counts, samples, rng)
+            rows.append({
+                "variable": variable,
+                "bin_order": bin_order,
+                "bin_label": label,
+                "hours": len(bin_counts),
+                "accidents": int(bin_counts.sum()),
+                "rate_per_1000h": rate * 1000,
+                "ci_low": ci_low * 1000,
+                "ci_high": ci_high * 1000,
+                "relative_rate": rate / overall_rate if not np.isnan(overall_rate) and overall_rate else None,
+            })
+    return rows
+
+def analyze_city(city, since, samples, use_cache):
+    """Загрузка, выравнивание и сводка по одному городу (выполняется в отдельном процессе)"""
+    with connect() as conn:
+        weather = load_weather(conn, city, since, use_cache)
+        dtp = load_dtp(conn, city, since, use_cache)
+    if weather is None or dtp is None:
+        return city, [], "нет данных погоды или ДТП"
+
+    if not np.any(dtp["seconds"] >= 0):
+        return city, [], "нет ДТП с указанным временем"
+
+    counts, grid, no_time = align_city(weather, dtp, city["timezone"])
+    # Свой генератор на город: результат воспроизводим и не зависит от числа процессов
+    rng = np.random.default_rng(int(city["district_id"]))
+    rows = summarize_city(counts, grid, samples, rng)
+    return city, rows, f"часов {len(counts)}, ДТП {int(counts.sum())}, без времени {no_time}"
+
+def write_summary(conn, city, rows):
+    """Сводка города целиком заменяет прежнюю в lbn.dtp_weather_summary"""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM lbn.dtp_weather_summary WHERE city_name = %s", (city["name"],))
+        execute_values(cur, """
+            INSERT INTO lbn.dtp_weather_summary (city_name, variable, bin_order, bin_label, hours, accidents,
+                rate_per_1000h, ci_low, ci_high, relative_rate)
+            VALUES %s
+        """, [(city["name"], row["variable"], row["bin_order"], row["bin_label"], row["hours"], row["accidents"],
+               float(row["rate_per_1000h"]), float(row["ci_low"]), float(row["ci_high"]),
+               None if row["relative_rate"] is None else float(row["relative_rate"])) for row in rows])
+    conn.commit()
+
+def print_summary(city, rows):
+    print(f"{'переменная':<16} {'интервал':<10} {'часов':>8} {'ДТП':>6} {'на 1000 ч':>10} {'95% ДИ':>17} {'к среднему':>10}")
+    for row in rows:
+        ci = f"{row['ci_low']:.2f}-{row['ci_high']:.2f}"
+        relative = f"{row['relative_rate']:.2f}" if row["relative_rate"] is not None else "-"
+        print(f"{row['variable']:<16} {row['bin_label']:<10} {row['hours']:>8} {row['accidents']:>6} "
+              f"{row['rate_per_1000h']:>10.2f} {ci:>17} {relative:>10}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Частота ДТП в зависимости от погоды с бутстреп-интервалами.")
+    parser.add_argument("--since", type=date.fromisoformat, default=date(2015, 1, 1),
+                        help="Анализировать данные начиная с даты YYYY-MM-DD (по умолчанию: 2015-01-01)")
+    parser.add_argument("--bootstrap", type=int, default=BOOTSTRAP_SAMPLES, help="Число бутстреп-выборок")
+    parser.add_argument("--workers", type=int, help="Число процессов (по умолчанию: по одному на город)")
+    parser.add_argument("--no_cache", action="store_true", help="Не использовать локальный кэш выборок")
+    parser.add_argument("--dry_run", action="store_true", help="Только вывести сводку, без записи в БД")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    cities = load_cities()
+    jobs = [(city, args.since, args.bootstrap, not args.no_cache) for city in cities]
+    workers = args.workers if args.workers is not None else len(cities)
+
+    if workers <= 1:
+        results = [analyze_city(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(analyze_city, *zip(*jobs)))
+
+    for city, rows, info in results:
+        print(f"\n{city['name']}: {info}")
+        if rows:
+            print_summary(city, rows)
+
+    if args.dry_run:
+        return
+    with connect() as conn:
+        for city, rows, _ in results:
+            if rows:
+                write_summary(conn, city, rows)
+    print("\nСводка записана в lbn.dtp_weather_summary")
+
+if __name__ == "__main__":
+    main()
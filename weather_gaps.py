@@ -0,0 +1,166 @@
+import argparse
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from db import ReconnectingPool
+from weather_db import CITIES, HOURLY_VARIABLES, process_batch
+from weather_tiering import HOT_FROM_YEAR
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+STEP = timedelta(hours=3)
+
+# Архив Open-Meteo отстает от текущей даты; более свежие часы заполняет ежедневный прогон
+ARCHIVE_DELAY_DAYS = 5
+# Дыры, между которыми не больше стольких дней, забираются одним запросом
+MERGE_GAP_DAYS = 7
+# Предел длины одного запроса к архиву
+MAX_REQUEST_DAYS = 366
+
+BATCH_SIZE = 8000
+
+def find_gaps(conn, city, since):
+    """
+    Пропущенные 3-часовые интервалы города одним запросом с оконной функцией.
+    Возвращает список (начало, конец) включительно, время в UTC.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT prev_date + INTERVAL '3 hours', date - INTERVAL '3 hours'
+            FROM (
+                SELECT date, LAG(date) OVER (ORDER BY date) AS prev_date
+                FROM lbn.weather
+                WHERE latitude = %s AND longitude = %s AND date >= %s
+            ) t
+            WHERE date - prev_date > INTERVAL '3 hours'
+            UNION ALL
+            -- Хвост: последняя запись старше, чем успевает покрыть архив
+            SELECT MAX(date) + INTERVAL '3 hours', NULL
+            FROM lbn.weather
+            WHERE latitude = %s AND longitude = %s
+            HAVING MAX(date) < CURRENT_DATE - %s * INTERVAL '1 day'
+            ORDER BY 1
+        """, (city["latitude"], city["longitude"], since,
+              city["latitude"], city["longitude"], ARCHIVE_DELAY_DAYS))
+        rows = cur.fetchall()
+
+    tail_end = datetime.combine(date.today() - timedelta(days=ARCHIVE_DELAY_DAYS), datetime.min.time())
+    gaps = [(start, end or tail_end) for start, end in rows]
+    return [(start, end) for start, end in gaps if start <= end]
+
+def plan_requests(gaps):
+    """
+    Объединяет дыры в минимальное число диапазонов дат для архивного API:
+    соседние дыры склеиваются, если между ними не больше MERGE_GAP_DAYS.
+    """
+    ranges = []
+    for start, end in gaps:
+        # Запрос идет по датам в Europe/Moscow, поэтому захватываем соседний день
+        start_day = start.date()
+        end_day = end.date() + timedelta(days=1)
+        if ranges and (start_day - ranges[-1][1]).days <= MERGE_GAP_DAYS \
+                and (end_day - ranges[-1][0]).days <= MAX_REQUEST_DAYS:
+            ranges[-1][1] = max(ranges[-1][1], end_day)
+        else:
+            ranges.append([start_day, end_day])
+
+    # Слишком длинные дыры режем на куски допустимой длины
+    result = []
+    for start_day, end_day in ranges:
+        while start_day <= end_day:
+            chunk_end = min(end_day, start_day + timedelta(days=MAX_REQUEST_DAYS - 1))
+            result.append((start_day, chunk_end))
+            start_day = chunk_end + timedelta(days=1)
+    return result
+
+def gap_rows(response, city, gaps):
+    """Строки для lbn.weather_BUFFER только по моментам, попадающим в дыры"""
+    import numpy as np
+
+    hourly = response.Hourly()
+    times = np.arange(hourly.Time(), hourly.TimeEnd(), hourly.Interval(), dtype=np.int64)
+    values = [hourly.Variables(i).ValuesAsNumpy() for i in range(len(HOURLY_VARIABLES))]
+
+    mask = np.zeros(len(times), dtype=bool)
+    for start, end in gaps:
+        start_ts = start.replace(tzinfo=timezone.utc).timestamp()
+        end_ts = end.replace(tzinfo=timezone.utc).timestamp()
+        mask |= (times >= start_ts) & (times <= end_ts)
+
+    for i in np.flatnonzero(mask):
+        row = [datetime.fromtimestamp(int(times[i]), tz=timezone.utc)]
+        row.extend(None if np.isnan(column[i]) else float(column[i]) for column in values)
+        row.extend([city["latitude"], city["longitude"]])
+        yield row
+
+def fill_gaps(conn, openmeteo, city, gaps):
+    total_rows = 0
+    for start_day, end_day in plan_requests(gaps):
+        print(f"  Запрос архива {start_day} - {end_day}")
+        params = {
+            "latitude": city["latitude"],
+            "longitude": city["longitude"],
+            "start_date": start_day.isoformat(),
+            "end_date": end_day.isoformat(),
+            "hourly": HOURLY_VARIABLES,
+            "timezone": "Europe/Moscow",
+            "temporal_resolution": "hourly_3"
+        }
+        response = openmeteo.weather_api(ARCHIVE_URL, params=params)[0]
+
+        batch = []
+        for row in gap_rows(response, city, gaps):
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                total_rows += process_batch(conn, batch)
+                batch = []
+        if batch:
+            total_rows += process_batch(conn, batch)
+        conn.commit()
+        time.sleep(1)  # Пауза между запросами
+    return total_rows
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Поиск и дозагрузка пропусков в lbn.weather.")
+    # Годы до HOT_FROM_YEAR сжаты в lbn.weather_daily и пропусками не считаются
+    parser.add_argument("--since", type=date.fromisoformat, default=date(HOT_FROM_YEAR, 1, 1),
+                        help=f"Искать пропуски начиная с даты YYYY-MM-DD (по умолчанию: {HOT_FROM_YEAR}-01-01)")
+    parser.add_argument("--dry_run", action="store_true", help="Только показать пропуски и план запросов")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # HTTP-клиенты тяжелые: импорт модуля и --help их не ждут
+    import openmeteo_requests
+    from retry_requests import retry
+    from weather_cache import make_session, finish_session
+
+    cache_session = make_session()
+    openmeteo = openmeteo_requests.Client(session=retry(cache_session, retries=5, backoff_factor=0.2))
+
+    pool = None
+    try:
+        # После разрыва соединения город дозагружается заново: upsert повторно записанных часов безопасен
+        pool = ReconnectingPool(1, 1)
+        for city in CITIES:
+            gaps = pool.run(find_gaps, city, args.since)
+
+            missing = sum((end - start) // STEP + 1 for start, end in gaps)
+            requests_plan = plan_requests(gaps)
+            print(f'Город {city["latitude"]}, {city["longitude"]}: пропусков {len(gaps)}, '
+                  f'интервалов {missing}, запросов к архиву {len(requests_plan)}')
+            for start, end in gaps:
+                print(f"  {start} - {end}")
+
+            if gaps and not args.dry_run:
+                print(f"  Дозагружено строк: {pool.run(fill_gaps, openmeteo, city, gaps)}")
+
+    except Exception as e:
+        print(f"Ошибка: {e}")
+    finally:
+        if pool is not None:
+            pool.close()
+        print(finish_session(cache_session))
+
+if __name__ == "__main__":
+    main()
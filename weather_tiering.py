@@ -0,0 +1,206 @@
+import argparse
+import os
+from datetime import date
+
+from db import connect
+
+# Годы начиная с этого хранятся в lbn.weather с шагом 3 часа (ДТП есть с 2014 года),
+# более ранние - дневными агрегатами в lbn.weather_daily
+HOT_FROM_YEAR = 2014
+
+# Полные 3-часовые ряды сжатых лет: <каталог>/<широта>_<долгота>/<год>.parquet
+ARCHIVE_DIR = 'weather_archive'
+
+# Лимит бесплатного тарифа Supabase
+DB_BUDGET_MB = 500
+
+# Оценки размера строки (с индексами), пока в таблице нет данных для замера
+HOT_ROW_BYTES_ESTIMATE = 200
+DAILY_ROW_BYTES_ESTIMATE = 150
+
+# Колонки lbn.weather_daily: (имя, тип, агрегат по 3-часовым строкам lbn.weather за сутки UTC)
+DAILY_COLUMNS = [
+    ("temperature_min", "REAL", "MIN(temperature_2m)"),
+    ("temperature_max", "REAL", "MAX(temperature_2m)"),
+    ("temperature_mean", "REAL", "AVG(temperature_2m)"),
+    ("apparent_temperature_mean", "REAL", "AVG(apparent_temperature)"),
+    ("wind_speed_mean", "REAL", "AVG(wind_speed_10m)"),
+    ("wind_speed_max", "REAL", "MAX(wind_speed_10m)"),
+    # Среднее направление считается по векторам, иначе 350 и 10 градусов дали бы 180
+    ("wind_direction_mean", "REAL",
+     "MOD(DEGREES(ATAN2(AVG(SIN(RADIANS(wind_direction_10m))), AVG(COS(RADIANS(wind_direction_10m))))) + 360, 360)"),
+    ("precipitation_sum", "REAL", "SUM(precipitation)"),
+    ("rain_sum", "REAL", "SUM(rain)"),
+    ("showers_sum", "REAL", "SUM(showers)"),
+    ("snowfall_sum", "REAL", "SUM(snowfall)"),
+    ("snow_depth_max", "REAL", "MAX(snow_depth)"),
+    ("daylight_hours", "REAL", "3 * COUNT(*) FILTER (WHERE is_day)"),
+    ("sunshine_duration_sum", "INT", "SUM(sunshine_duration)"),
+    ("samples", "SMALLINT", "COUNT(*)"),
+]
+
+def daily_select(where):
+    """SELECT дневных агрегатов из lbn.weather (общий для сжатия и представления lbn.v_weather_daily)"""
+    aggregates = ",\n        ".join(f"{expression}::{column_type} AS {name}"
+                                   for name, column_type, expression in DAILY_COLUMNS)
+    return f"""
+        SELECT latitude, longitude, date::DATE AS day,
+        {aggregates}
+        FROM lbn.weather
+        WHERE {where}
+        GROUP BY latitude, longitude, date::DATE
+    """
+
+def archive_path(latitude, longitude, year, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{latitude}_{longitude}", f"{year}.parquet")
+
+def cold_years(cur, keep_from):
+    """(широта, долгота, год) в lbn.weather старше границы горячего слоя"""
+    cur.execute("""
+        SELECT DISTINCT latitude, longitude, EXTRACT(YEAR FROM date)::INT
+        FROM lbn.weather
+        WHERE date < %s
+        ORDER BY 1, 2, 3
+    """, (date(keep_from, 1, 1),))
+    return cur.fetchall()
+
+def archive_year(conn, latitude, longitude, year, archive_dir=ARCHIVE_DIR):
+    """
+    Выгрузка 3-часовых строк года в Parquet (zstd) с проверкой числа строк.
+    Файл пишется через временный; существующий архив года дополняется, а не затирается.
+    """
+    import pandas as pd
+    from local_mirror import read_frames
+
+    where = "latitude = %s AND longitude = %s AND date >= %s AND date < %s"
+    params = (latitude, longitude, date(year, 1, 1), date(year + 1, 1, 1))
+    frames = list(read_frames(conn, f"SELECT * FROM lbn.weather WHERE {where} ORDER BY date", params))
+    frame = pd.concat(frames, ignore_index=True)
+
+    path = archive_path(latitude, longitude, year, archive_dir)
+    if os.path.exists(path):
+        # Повторный запуск после сбоя: архив мог уже содержать строки, удаленные из БД
+        archived = pd.read_parquet(path)
+        frame = pd.concat([archived, frame], ignore_index=True).drop_duplicates(subset=["date"], keep="last")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frame.to_parquet(path + '.tmp', index=False, compression='zstd')
+    os.replace(path + '.tmp', path)
+
+    if len(pd.read_parquet(path, columns=["date"])) != len(frame):
+        raise RuntimeError(f"Архив {path} записан не полностью")
+    return len(frame)
+
+def compact_year(conn, latitude, longitude, year):
+    """Дневные агрегаты года в lbn.weather_daily и удаление 3-часовых строк одной транзакцией"""
+    where = "latitude = %s AND longitude = %s AND date >= %s AND date < %s"
+    params = (latitude, longitude, date(year, 1, 1), date(year + 1, 1, 1))
+    columns = ", ".join(name for name, _, _ in DAILY_COLUMNS)
+    updates = ",\n            ".join(f"{name} = EXCLUDED.{name}" for name, _, _ in DAILY_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO lbn.weather_daily (latitude, longitude, day, {columns})
+            {daily_select(where)}
+            ON CONFLICT (latitude, longitude, day) DO UPDATE SET
+            {updates},
+            date_update = CURRENT_TIMESTAMP
+        """, params)
+        days = cur.rowcount
+        cur.execute(f"DELETE FROM lbn.weather WHERE {where}", params)
+        deleted = cur.rowcount
+    conn.commit()
+    return days, deleted
+
+def compact(conn, keep_from=HOT_FROM_YEAR, dry_run=False, archive_dir=ARCHIVE_DIR):
+    with conn.cursor() as cur:
+        years = cold_years(cur, keep_from)
+    print(f"Лет к сжатию (по городам): {len(years)}")
+    for latitude, longitude, year in years:
+        if dry_run:
+            print(f"  {latitude}, {longitude}: {year}")
+            continue
+        archived = archive_year(conn, latitude, longitude, year, archive_dir)
+        days, deleted = compact_year(conn, latitude, longitude, year)
+        print(f"  {latitude}, {longitude}: {year} - в архиве {archived} строк, дней {days}, удалено {deleted}")
+
+def vacuum(conn):
+    """Возврат места после удаления: VACUUM FULL переписывает таблицу (блокирует ее на время работы)"""
+    # VACUUM не выполняется внутри транзакции
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("VACUUM FULL lbn.weather")
+            cur.execute("VACUUM ANALYZE lbn.weather_daily")
+    finally:
+        conn.autocommit = autocommit
+
+def table_sizes(cur):
+    cur.execute("""
+        SELECT c.relname, GREATEST(c.reltuples, 0)::BIGINT, pg_total_relation_size(c.oid),
+            pg_relation_size(c.oid), pg_indexes_size(c.oid)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'lbn' AND c.relkind IN ('r', 'm')
+        ORDER BY 3 DESC
+    """)
+    return cur.fetchall()
+
+def city_capacity(sizes, database_bytes, keep_from=HOT_FROM_YEAR, budget_mb=DB_BUDGET_MB):
+    """
+    Сколько городов с погодой с 1940 года помещается в бюджет: без сжатия
+    и с текущим разделением на горячие годы и дневные агрегаты.
+    """
+    by_name = {name: (rows, total) for name, rows, total, _, _ in sizes}
+    weather_rows, weather_bytes = by_name.get("weather", (0, 0))
+    daily_rows, daily_bytes = by_name.get("weather_daily", (0, 0))
+    hot_row = weather_bytes / weather_rows if weather_rows else HOT_ROW_BYTES_ESTIMATE
+    daily_row = daily_bytes / daily_rows if daily_rows else DAILY_ROW_BYTES_ESTIMATE
+
+    years_total = date.today().year - 1940 + 1
+    years_hot = date.today().year - keep_from + 1
+    full_city = years_total * 365 * 8 * hot_row
+    tiered_city = years_hot * 365 * 8 * hot_row + (years_total - years_hot) * 365 * daily_row
+
+    # Все, кроме погоды, считается постоянной частью
+    free_bytes = budget_mb * 1024 * 1024 - (database_bytes - weather_bytes - daily_bytes)
+    return max(free_bytes, 0) / full_city, max(free_bytes, 0) / tiered_city, full_city, tiered_city
+
+def report(conn, keep_from=HOT_FROM_YEAR, budget_mb=DB_BUDGET_MB):
+    with conn.cursor() as cur:
+        sizes = table_sizes(cur)
+        cur.execute("SELECT pg_database_size(current_database())")
+        database_bytes = cur.fetchone()[0]
+
+    mb = 1024 * 1024
+    print(f"{'таблица':<24} {'строк':>10} {'всего, МБ':>10} {'данные, МБ':>11} {'индексы, МБ':>12}")
+    for name, rows, total, data, indexes in sizes:
+        print(f"{name:<24} {rows:>10} {total / mb:>10.1f} {data / mb:>11.1f} {indexes / mb:>12.1f}")
+    print(f"База целиком: {database_bytes / mb:.1f} МБ из {budget_mb} МБ")
+
+    full_cities, tiered_cities, full_city, tiered_city = city_capacity(sizes, database_bytes, keep_from, budget_mb)
+    print(f"Погода одного города с 1940 года: {full_city / mb:.1f} МБ без сжатия, "
+          f"{tiered_city / mb:.1f} МБ с 3-часовыми данными с {keep_from} года")
+    print(f"Городов в бюджете: {full_cities:.0f} без сжатия, {tiered_cities:.0f} со сжатием")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сжатие старых лет lbn.weather в дневные агрегаты и отчет о размере.")
+    parser.add_argument("command", choices=["report", "compact"],
+                        help="report - размеры таблиц; compact - архивировать и сжать годы до --keep_from")
+    parser.add_argument("--keep_from", type=int, default=HOT_FROM_YEAR,
+                        help=f"Первый год с 3-часовыми данными (по умолчанию: {HOT_FROM_YEAR})")
+    parser.add_argument("--dry_run", action="store_true", help="Только показать годы к сжатию")
+    parser.add_argument("--vacuum", action="store_true", help="После сжатия вернуть место (VACUUM FULL)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with connect() as conn:
+        if args.command == "compact":
+            compact(conn, args.keep_from, args.dry_run)
+            if args.vacuum and not args.dry_run:
+                vacuum(conn)
+        report(conn, args.keep_from)
+
+if __name__ == "__main__":
+    main()